@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+merge_segments 基准 — 对比旧实现（逐字符时间戳数组）和当前实现的耗时与内存峰值
+
+用法:
+    python bench_merge_segments.py              # 1h / 3h / 6h，带标点和无标点各一份
+    python bench_merge_segments.py --hours 3 --repeat 5
+"""
+
+import argparse
+import random
+import re
+import time
+import tracemalloc
+
+from server.services.transcript_fetch import merge_segments
+
+WORDS = (
+    "so we basically need to circle back on the roadmap and figure out what the team "
+    "can actually ship this quarter without burning everyone out on the way there"
+).split()
+
+
+def make_segments(hours: float, punctuated: bool, seed: int = 0) -> list[dict]:
+    """生成约 hours 小时的自动字幕：每段 2-4 秒、4-12 个词，偶尔有空段"""
+    rng = random.Random(seed)
+    segments = []
+    t = 0.0
+    while t < hours * 3600:
+        duration = round(rng.uniform(2.0, 4.0), 2)
+        if rng.random() < 0.02:
+            text = "  "
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12)))
+            if punctuated and rng.random() < 0.35:
+                text += rng.choice(".?!")
+        segments.append({"text": text, "start": round(t, 2), "duration": duration})
+        t += duration
+    return segments
+
+
+# 改写前的实现，仅用于对照输出和性能
+def legacy_merge_segments(segments: list[dict], soft_max: int = 200, hard_max: int = 500) -> list[dict]:
+    """
+    将碎片化的字幕段落合并为可读的段落块
+
+    思路: 先把所有 segment 合并成完整文本，用正则找到所有句子边界，
+    然后按 soft_max/hard_max 把句子分组为段落，最后根据字符偏移
+    反查对应的时间戳。
+    """
+    if not segments:
+        return []
+
+    # Step 1: 构建字符偏移 → 时间戳的映射
+    # 把所有 segment 拼成完整文本，同时记录每个字符对应的时间
+    full_text = ""
+    char_times = []  # char_times[i] = 该字符对应的 start 时间
+    char_ends = []   # char_ends[i] = 该字符对应的 segment end 时间
+
+    for seg in segments:
+        text = seg["text"].strip()
+        if not text:
+            continue
+        seg_start = seg["start"]
+        seg_end = seg["start"] + seg["duration"]
+        if full_text:
+            # 加空格连接
+            full_text += " "
+            char_times.append(seg_start)
+            char_ends.append(seg_end)
+        for _ in text:
+            char_times.append(seg_start)
+            char_ends.append(seg_end)
+        full_text += text
+
+    if not full_text:
+        return []
+
+    # Step 2: 找到所有句子边界位置（句末标点后跟空格或字符串结尾）
+    sentence_ends = []  # 每个元素是句末标点后的字符位置（切分点）
+    for m in re.finditer(r'[.?!](?:\s|$)', full_text):
+        # 切分点在标点后面的空格之后
+        end_pos = m.end()
+        sentence_ends.append(end_pos)
+
+    # Step 3: 按句子边界分段，尊重 soft_max 和 hard_max
+    merged = []
+    para_start = 0  # 当前段落在 full_text 中的起始位置
+
+    if not sentence_ends:
+        # 没有句末标点，按 hard_max 强制切分
+        while para_start < len(full_text):
+            end = min(para_start + hard_max, len(full_text))
+            # 尝试在空格处切
+            if end < len(full_text):
+                space_pos = full_text.rfind(" ", para_start, end)
+                if space_pos > para_start:
+                    end = space_pos + 1
+            text = full_text[para_start:end].strip()
+            if text:
+                merged.append({
+                    "text": text,
+                    "start": char_times[para_start],
+                    "duration": char_ends[min(end - 1, len(char_ends) - 1)] - char_times[para_start],
+                })
+            para_start = end
+    else:
+        se_idx = 0  # sentence_ends 的索引
+        while para_start < len(full_text) and se_idx <= len(sentence_ends):
+            # 从 para_start 开始，累积句子直到超过 soft_max
+            best_end = None
+
+            while se_idx < len(sentence_ends):
+                candidate = sentence_ends[se_idx]
+                chunk_len = candidate - para_start
+
+                if chunk_len >= soft_max:
+                    # 超过 soft_max，在这里切
+                    best_end = candidate
+                    se_idx += 1
+                    break
+
+                # 还没到 soft_max，记录这个候选点，继续看下一个
+                best_end = candidate
+                se_idx += 1
+
+            # 如果没有更多句子边界了，把剩余文本全部收入
+            if se_idx >= len(sentence_ends) and best_end is not None:
+                remaining_text = full_text[best_end:].strip()
+                if remaining_text:
+                    # 剩余部分不够组成新段落，合并到当前段
+                    if len(remaining_text) < soft_max * 0.4:
+                        best_end = len(full_text)
+                        se_idx = len(sentence_ends) + 1  # 标记结束
+
+            if best_end is None:
+                best_end = len(full_text)
+
+            text = full_text[para_start:best_end].strip()
+            if text:
+                start_idx = para_start
+                end_idx = min(best_end - 1, len(char_times) - 1)
+                merged.append({
+                    "text": text,
+                    "start": char_times[start_idx],
+                    "duration": char_ends[end_idx] - char_times[start_idx],
+                })
+
+            para_start = best_end
+            if para_start >= len(full_text):
+                break
+
+        # 处理最后剩余的文本（在最后一个句子边界之后）
+        if para_start < len(full_text):
+            text = full_text[para_start:].strip()
+            if text:
+                if merged and len(text) < soft_max * 0.4:
+                    # 太短，合并到上一段
+                    merged[-1]["text"] += " " + text
+                    merged[-1]["duration"] = char_ends[-1] - merged[-1]["start"]
+                else:
+                    merged.append({
+                        "text": text,
+                        "start": char_times[para_start],
+                        "duration": char_ends[-1] - char_times[para_start],
+                    })
+
+    # Step 4: 处理时间间隔过大的情况（> 3秒的停顿应该分段）
+    final = []
+    for para in merged:
+        final.append(para)
+
+    return final
+
+
+def measure(fn, segments: list[dict], repeat: int) -> tuple[list[dict], float, int]:
+    """返回 (结果, 最快一次耗时秒, 内存峰值字节)"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(segments)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(segments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="merge_segments benchmark")
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 3, 6])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'transcript':<18} {'chars':>10} {'impl':<8} {'time':>9} {'peak mem':>10}")
+    for hours in args.hours:
+        for punctuated in (True, False):
+            segments = make_segments(hours, punctuated)
+            chars = sum(len(s["text"]) for s in segments)
+            label = f"{hours:g}h {'punct' if punctuated else 'no-punct'}"
+            old, old_time, old_peak = measure(legacy_merge_segments, segments, args.repeat)
+            # 空段会形成停顿，关闭停顿分段后才能与旧实现逐项对照
+            new, new_time, new_peak = measure(lambda segs: merge_segments(segs, pause_gap=None), segments, args.repeat)
+            assert new == old, f"{label}: output differs from legacy implementation"
+            for impl, seconds, peak in (("legacy", old_time, old_peak), ("current", new_time, new_peak)):
+                print(f"{label:<18} {chars:>10,} {impl:<8} {seconds * 1000:>7.1f}ms {peak / 2**20:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,39 @@
 """
 
 import argparse
+import asyncio
 import re
 import sys
 from pathlib import Path
 from datetime import datetime
 
 from server.services.ai_pipeline import (
+    arun_step1,
+    arun_step2,
+    atranscript_prefix,
     load_persona,
-    run_step1,
-    run_step2,
     OUTPUT_DIR,
 )
+from server.services.llm_clients import aclose_clients
+
+
+async def _run_steps(transcript: str, persona: str) -> tuple[str, str, str, str]:
+    """两步在同一个事件循环里执行，共用 provider 连接池和同一个 transcript 前缀"""
+    try:
+        prefix = await atranscript_prefix(transcript)
+
+        print(f"\n{'─' * 40}")
+        print("Step 1: Layer 0 — 价值桥分析")
+        print(f"{'─' * 40}")
+        layer0, model1 = await arun_step1(prefix, persona)
+
+        print(f"\n{'─' * 40}")
+        print("Step 2: 4-Layer Breakdown + 交付物")
+        print(f"{'─' * 40}")
+        breakdown, model2 = await arun_step2(prefix, persona, layer0)
+        return layer0, model1, breakdown, model2
+    finally:
+        await aclose_clients()
 
 
 def run_pipeline(transcript: str, persona_name: str = "外贸小白"):
@@ -31,15 +53,7 @@ def run_pipeline(transcript: str, persona_name: str = "外贸小白"):
     print(f"\n📋 用户画像: {persona_name}")
     print(f"📄 Transcript 长度: {len(transcript)} 字符")
 
-    print(f"\n{'─' * 40}")
-    print("Step 1: Layer 0 — 价值桥分析")
-    print(f"{'─' * 40}")
-    layer0, model1 = run_step1(transcript, persona)
-
-    print(f"\n{'─' * 40}")
-    print("Step 2: 4-Layer Breakdown + 交付物")
-    print(f"{'─' * 40}")
-    breakdown, model2 = run_step2(transcript, persona, layer0)
+    layer0, model1, breakdown, model2 = asyncio.run(_run_steps(transcript, persona))
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
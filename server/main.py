@@ -2,12 +2,28 @@
 FastAPI 主应用
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from server.routers import transcript, analyze, personas, deck
+from server.routers import transcript, analyze, personas, deck, metrics
+from server.services.cache_store import start_cache_maintenance
+from server.services.llm_clients import aclose_clients
+from server.services.word_highlighter import start_dictionary_watcher
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 词典热更新：编辑 server/data/dictionaries/ 下的 JSON 后无需重启
+    start_dictionary_watcher()
+    # video_cache 定期过期 / 淘汰 / 回收空间
+    start_cache_maintenance()
+    yield
+    await aclose_clients()
+
 
-app = FastAPI(title="Video Breakdown API", version="0.1.0")
+app = FastAPI(title="Video Breakdown API", version="0.1.0", lifespan=lifespan)
 
 # CORS — 允许 Next.js dev server 访问
 app.add_middleware(
@@ -22,6 +38,7 @@ app.include_router(transcript.router)
 app.include_router(analyze.router)
 app.include_router(personas.router)
 app.include_router(deck.router)
+app.include_router(metrics.router)
 
 
 @app.get("/api/health")
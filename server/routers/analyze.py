@@ -4,22 +4,31 @@ AI 分析路由 — SSE 流式推送
 
 import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 
-from server.services.ai_pipeline import run_pipeline_streaming
+from server.services.ai_pipeline import arun_pipeline_streaming
 
 router = APIRouter()
-executor = ThreadPoolExecutor(max_workers=2)
 
 
 class AnalyzeRequest(BaseModel):
     transcript: str
     persona: str = "外贸小白"
     video_url: str = ""
+    stream_tokens: bool = True  # 是否推送模型逐段输出的 delta 事件
+
+
+def _format_event(event: dict) -> dict:
+    data = event["data"]
+    if isinstance(data, dict):
+        data = json.dumps(data, ensure_ascii=False)
+    return {
+        "event": event["event"],
+        "data": data,
+    }
 
 
 @router.post("/api/analyze")
@@ -28,26 +37,38 @@ async def analyze(request: AnalyzeRequest):
         raise HTTPException(status_code=400, detail="Transcript 太短，至少需要 50 个字符")
 
     async def event_generator():
-        loop = asyncio.get_event_loop()
+        # pipeline 任务每产生一个事件就投递进队列，None 表示结束
+        queue: asyncio.Queue[dict | None] = asyncio.Queue()
+
+        def on_delta(step: str, text: str, model: str):
+            queue.put_nowait({"event": "delta", "data": {"step": step, "text": text, "model": model}})
 
-        # 在线程池中运行同步的 pipeline
-        def run_sync():
-            return list(run_pipeline_streaming(request.transcript, request.persona))
+        # 直接在事件循环上运行异步 pipeline，事件边产生边推送
+        async def run_pipeline():
+            try:
+                async for event in arun_pipeline_streaming(
+                    request.transcript,
+                    request.persona,
+                    on_delta=on_delta if request.stream_tokens else None,
+                ):
+                    queue.put_nowait(event)
+            except Exception as e:
+                queue.put_nowait({
+                    "event": "error",
+                    "data": f"Pipeline 执行出错: {str(e)[:300]}",
+                })
+            finally:
+                queue.put_nowait(None)
 
+        task = asyncio.create_task(run_pipeline())
         try:
-            events = await loop.run_in_executor(executor, run_sync)
-            for event in events:
-                data = event["data"]
-                if isinstance(data, dict):
-                    data = json.dumps(data, ensure_ascii=False)
-                yield {
-                    "event": event["event"],
-                    "data": data,
-                }
-        except Exception as e:
-            yield {
-                "event": "error",
-                "data": f"Pipeline 执行出错: {str(e)[:300]}",
-            }
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield _format_event(event)
+        finally:
+            # 客户端断开时取消仍在进行的模型调用
+            task.cancel()
 
     return EventSourceResponse(event_generator())
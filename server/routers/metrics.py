@@ -0,0 +1,29 @@
+"""
+运行指标路由 — LLM provider 连接复用、健康度、缓存命中等
+"""
+
+from fastapi import APIRouter
+
+from server.services.cache_store import memory_cache_stats
+from server.services.llm_clients import connection_stats
+from server.services.provider_health import snapshot as provider_health_snapshot
+
+router = APIRouter()
+
+
+@router.get("/api/metrics/connections")
+async def get_connection_metrics():
+    """各 provider 的 HTTP 连接复用情况"""
+    return {"providers": connection_stats()}
+
+
+@router.get("/api/metrics/providers")
+async def get_provider_health():
+    """各 provider/model 的熔断状态、错误率和 p50/p95 延迟"""
+    return {"providers": provider_health_snapshot()}
+
+
+@router.get("/api/metrics/cache")
+async def get_cache_metrics():
+    """video_cache 内存层的占用和命中率"""
+    return {"memory": memory_cache_stats()}
@@ -5,16 +5,24 @@
 import re
 import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import itertools
 
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
-
-from server.services.transcript_fetch import extract_video_id, fetch_transcript, merge_segments, NoCaptionsError
-from server.services.word_highlighter import highlight_segments
-from server.services.ai_pipeline import generate_toc, generate_context_notes, generate_highlights
-from server.services.cache_store import get_cache, set_cache
+from starlette.concurrency import iterate_in_threadpool
+
+from server.services.transcript_fetch import (
+    extract_video_id, iter_transcript, load_transcript, NoCaptionsError, SEGMENTATION_TAG,
+)
+from server.services.word_highlighter import current_dictionary, highlight_segments, iter_highlight_segments
+from server.services.ai_pipeline import (
+    agenerate_toc, agenerate_context_notes, agenerate_highlights, chunk_input_budget,
+    CONTEXT_NOTES_MODELS, CONTEXT_NOTES_CHUNK_BUDGET, HIGHLIGHTS_MODELS, HIGHLIGHTS_CHUNK_BUDGET,
+)
+from server.services.chunk_planner import plan_chunks
+from server.services.live_transcript import end_session, get_session
+from server.services.cache_store import aget_cache, aget_many, aset_cache
 
 router = APIRouter()
 
@@ -35,21 +43,78 @@ async def get_transcript(
         raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        segments = fetch_transcript(video_id)
-        segments = merge_segments(segments)
+        # 抓取 / 合并 / 读写缓存都是阻塞操作，放到线程里
+        segments = await asyncio.to_thread(load_transcript, video_id)
     except NoCaptionsError:
         raise HTTPException(status_code=404, detail={"code": "NO_CAPTIONS", "message": "This video has no captions available. Please try a video with subtitles."})
     except RuntimeError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
-    if highlight:
-        segments = highlight_segments(segments)
-
-    return {
+    result = {
         "video_id": video_id,
         "segments": segments,
         "total_segments": len(segments),
     }
+    if highlight:
+        # 词典可能热更新，固定用这一份快照并返回其版本，供前端判断缓存是否过期
+        dictionary = current_dictionary()
+        result["segments"] = highlight_segments(segments, dictionary=dictionary)
+        result["dictionary_version"] = dictionary.version
+
+    return result
+
+
+@router.get("/api/transcript/stream")
+async def get_transcript_stream(
+    url: str = Query(..., description="YouTube 视频 URL"),
+    highlight: bool = Query(True, description="是否添加词汇高亮"),
+):
+    """
+    /api/transcript 的 SSE 版本：段落合并、高亮完成一个推送一个，长视频可以先渲染前几分钟
+
+    事件: meta {video_id, dictionary_version?} → segment {text, start, duration, highlights?} × N
+    → done {total_segments}
+    """
+    try:
+        video_id = extract_video_id(url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    paragraphs = iter_transcript(video_id)
+    try:
+        # 第一次 next() 才抓取字幕（阻塞的网络 I/O，放到线程里），出错时还没开始推流，照常返回 HTTP 错误
+        first = await asyncio.to_thread(next, paragraphs, None)
+    except NoCaptionsError:
+        raise HTTPException(status_code=404, detail={"code": "NO_CAPTIONS", "message": "This video has no captions available. Please try a video with subtitles."})
+    except RuntimeError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    dictionary = current_dictionary() if highlight else None
+
+    async def event_generator():
+        meta = {"video_id": video_id}
+        if dictionary is not None:
+            meta["dictionary_version"] = dictionary.version
+        yield {"event": "meta", "data": json.dumps(meta)}
+
+        total = 0
+        if first is not None:
+            stream = itertools.chain([first], paragraphs)
+            if dictionary is not None:
+                stream = iter_highlight_segments(stream, dictionary=dictionary)
+            # 合并、高亮和最后写入缓存都在线程里推进，不占事件循环
+            async for segment in iterate_in_threadpool(stream):
+                total += 1
+                yield {"event": "segment", "data": json.dumps(segment, ensure_ascii=False)}
+
+        yield {"event": "done", "data": json.dumps({"total_segments": total})}
+
+    return EventSourceResponse(event_generator())
+
+
+def _segmented(module: str) -> str:
+    """依赖段落下标 / 字符位置的缓存模块名，带上当前切分方式，切分一变自动换键"""
+    return f"{module}:{SEGMENTATION_TAG}"
 
 
 def _format_timestamp(seconds: float) -> str:
@@ -68,9 +133,10 @@ async def gen_toc(request: TocRequest):
 
     # 检查缓存
     if request.video_id:
-        cached = get_cache(request.video_id, "chapters")
+        cached = await aget_cache(request.video_id, "chapters")
         if cached:
-            chapters = cached
+            # 缓存对象在内存层共享，复制后再加 segmentRange
+            chapters = [dict(ch) for ch in cached]
             # 仍需计算 segmentRange（依赖当前 segments）
             for idx, ch in enumerate(chapters):
                 ch_start = ch["start_time"]
@@ -94,7 +160,7 @@ async def gen_toc(request: TocRequest):
     transcript_with_ts = "\n".join(lines)
 
     try:
-        chapters = generate_toc(transcript_with_ts)
+        chapters = await agenerate_toc(transcript_with_ts)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ToC generation failed: {str(e)[:300]}")
 
@@ -121,7 +187,7 @@ async def gen_toc(request: TocRequest):
 
     # 存入缓存（存修正后的 chapters，不含 segmentRange）
     if request.video_id:
-        set_cache(request.video_id, "chapters", chapters)
+        await aset_cache(request.video_id, "chapters", chapters)
 
     # 根据时间戳计算每个章节对应的 segment 索引范围
     for idx, ch in enumerate(chapters):
@@ -151,9 +217,6 @@ class ContextNotesRequest(BaseModel):
     video_id: str | None = None
 
 
-CONTEXT_NOTES_CHUNK_SIZE = 50
-
-
 @router.post("/api/generate-context-notes")
 async def gen_context_notes(request: ContextNotesRequest):
     """用 AI 生成上下文注释（分 chunk 处理避免 AI 输出截断）"""
@@ -164,19 +227,19 @@ async def gen_context_notes(request: ContextNotesRequest):
 
     # 检查缓存
     if request.video_id:
-        cached = get_cache(request.video_id, "context_notes")
+        cached = await aget_cache(request.video_id, _segmented("context_notes"))
         if cached:
             return cached
 
-    # 分 chunk 处理
+    # 按 token 预算分 chunk 处理
     all_notes = []
-    for i in range(0, len(segments), CONTEXT_NOTES_CHUNK_SIZE):
-        chunk_segs = segments[i:i + CONTEXT_NOTES_CHUNK_SIZE]
+    max_tokens = chunk_input_budget(CONTEXT_NOTES_MODELS, CONTEXT_NOTES_CHUNK_BUDGET)
+    for (i, chunk_segs, _) in plan_chunks(segments, max_tokens):
         lines = [f"[{i + idx}] {seg.get('text', '')}" for idx, seg in enumerate(chunk_segs)]
         indexed_transcript = "\n".join(lines)
 
         try:
-            chunk_notes = generate_context_notes(indexed_transcript)
+            chunk_notes = await agenerate_context_notes(indexed_transcript)
             all_notes.extend(chunk_notes)
             print(f"Context notes chunk [{i}-{i+len(chunk_segs)}]: {len(chunk_notes)} notes")
         except Exception as e:
@@ -190,7 +253,7 @@ async def gen_context_notes(request: ContextNotesRequest):
 
     # 存入缓存
     if request.video_id:
-        set_cache(request.video_id, "context_notes", result)
+        await aset_cache(request.video_id, _segmented("context_notes"), result)
 
     return result
 
@@ -329,34 +392,29 @@ async def gen_highlights(request: HighlightsRequest):
 
     # 检查缓存
     if request.video_id:
-        cached = get_cache(request.video_id, "highlights")
+        cached = await aget_cache(request.video_id, _segmented("highlights"))
         if cached:
             return cached
 
-    CHUNK_SIZE = 50
+    chunk_specs = plan_chunks(segments, chunk_input_budget(HIGHLIGHTS_MODELS, HIGHLIGHTS_CHUNK_BUDGET))
+    failed_chunks: list[str] = []
 
-    if len(segments) > CHUNK_SIZE:
+    if len(chunk_specs) > 1:
         all_highlights = []
-        failed_chunks: list[str] = []
 
-        for i in range(0, len(segments), CHUNK_SIZE):
-            chunk = segments[i:i+CHUNK_SIZE]
+        for (i, chunk, _) in chunk_specs:
             chunk_indexed = "\n".join([f"[{i+idx}] {s.get('text', '')}" for idx, s in enumerate(chunk)])
-            chunk_end = min(i + CHUNK_SIZE, len(segments))
+            chunk_end = i + len(chunk)
             chunk_label = f"[{i}-{chunk_end}]"
 
-            for attempt in range(3):
-                try:
-                    chunk_highlights = generate_highlights(chunk_indexed)
-                    all_highlights.extend(chunk_highlights)
-                    print(f"Chunk {chunk_label}: {len(chunk_highlights)} highlights")
-                    break
-                except Exception as e:
-                    if attempt < 2:
-                        print(f"Chunk {chunk_label} attempt {attempt+1} failed, retrying: {str(e)[:100]}")
-                    else:
-                        print(f"ERROR: Chunk {chunk_label} failed after 3 attempts: {str(e)[:100]}")
-                        failed_chunks.append(chunk_label)
+            # 模型 fallback 和截断续写都在 agenerate_highlights 内部处理，这里不再整体重试
+            try:
+                chunk_highlights = await agenerate_highlights(chunk_indexed)
+                all_highlights.extend(chunk_highlights)
+                print(f"Chunk {chunk_label}: {len(chunk_highlights)} highlights")
+            except Exception as e:
+                print(f"ERROR: Chunk {chunk_label} failed: {str(e)[:100]}")
+                failed_chunks.append(chunk_label)
 
         if failed_chunks:
             print(f"WARNING: {len(failed_chunks)} chunks failed: {', '.join(failed_chunks)}")
@@ -364,7 +422,7 @@ async def gen_highlights(request: HighlightsRequest):
     else:
         indexed_transcript = "\n".join([f"[{idx}] {seg.get('text', '')}" for idx, seg in enumerate(segments)])
         try:
-            raw_highlights = generate_highlights(indexed_transcript)
+            raw_highlights = await agenerate_highlights(indexed_transcript)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Highlights generation failed: {str(e)[:300]}")
 
@@ -377,9 +435,9 @@ async def gen_highlights(request: HighlightsRequest):
     dropped = input_count - output_count
     print(f"Highlights pipeline: {input_count} raw → {output_count} matched ({dropped} dropped, {dropped/input_count*100:.0f}% loss)" if input_count > 0 else "Highlights pipeline: 0 raw highlights")
 
-    has_failed_chunks = len(segments) > CHUNK_SIZE and len(failed_chunks) > 0
+    has_failed_chunks = len(failed_chunks) > 0
     if request.video_id and not has_failed_chunks:
-        set_cache(request.video_id, "highlights", result)
+        await aset_cache(request.video_id, _segmented("highlights"), result)
     elif has_failed_chunks:
         print(f"WARNING: Not caching highlights — incomplete results due to failed chunks")
 
@@ -388,15 +446,12 @@ async def gen_highlights(request: HighlightsRequest):
 
 # --- Streaming highlights endpoint (parallel + SSE) ---
 
-HIGHLIGHT_FALLBACK_CHUNK_SIZE = 50
-HIGHLIGHT_MAX_CHUNK_SEGMENTS = 20  # 超过此数量的 chapter 会被拆分为 sub-chunks
-HIGHLIGHT_CONCURRENCY = 4
-_highlight_executor = ThreadPoolExecutor(max_workers=HIGHLIGHT_CONCURRENCY)
+HIGHLIGHT_CONCURRENCY = 4  # 单个请求内同时在途的 chunk 数（限流用，不占线程）
 
 
 @router.post("/api/generate-highlights-stream")
 async def gen_highlights_stream(request: HighlightsRequest):
-    """用 AI 生成词汇高亮 — SSE 流式，按 chapter 或固定大小分 chunk 并行处理"""
+    """用 AI 生成词汇高亮 — SSE 流式，按 chapter 和 token 预算分 chunk 并行处理"""
     segments = request.segments
 
     if not segments:
@@ -404,7 +459,7 @@ async def gen_highlights_stream(request: HighlightsRequest):
 
     # 快速路径：全量缓存命中
     if request.video_id:
-        cached = get_cache(request.video_id, "highlights")
+        cached = await aget_cache(request.video_id, _segmented("highlights"))
         if cached:
             async def cached_stream():
                 yield {"event": "chunk_result", "data": json.dumps(cached, ensure_ascii=False)}
@@ -412,49 +467,24 @@ async def gen_highlights_stream(request: HighlightsRequest):
             return EventSourceResponse(cached_stream())
 
     async def event_generator():
-        loop = asyncio.get_event_loop()
-
-        # 构建 chunk 列表：按 chapter 或固定大小
+        # 构建 chunk 列表：不跨 chapter，超出 token 预算的 chapter 均匀拆分为 sub-chunks
         # chunk_specs: [(start_idx, chunk_segs, title), ...]
-        chunk_specs: list[tuple[int, list[dict], str]] = []
-
-        if request.chapters and len(request.chapters) > 0:
-            for ch in request.chapters:
-                seg_range = ch.get("segmentRange", [0, len(segments) - 1])
-                start_idx = seg_range[0]
-                end_idx = seg_range[1]
-                chunk_segs = segments[start_idx:end_idx + 1]
-                title = ch.get("title", "")
-
-                if len(chunk_segs) > HIGHLIGHT_MAX_CHUNK_SEGMENTS:
-                    # 长 chapter 拆分为 sub-chunks
-                    for sub_i in range(0, len(chunk_segs), HIGHLIGHT_MAX_CHUNK_SEGMENTS):
-                        sub_segs = chunk_segs[sub_i:sub_i + HIGHLIGHT_MAX_CHUNK_SEGMENTS]
-                        sub_start = start_idx + sub_i
-                        part_num = sub_i // HIGHLIGHT_MAX_CHUNK_SEGMENTS + 1
-                        total_parts = (len(chunk_segs) + HIGHLIGHT_MAX_CHUNK_SEGMENTS - 1) // HIGHLIGHT_MAX_CHUNK_SEGMENTS
-                        sub_title = f"{title} ({part_num}/{total_parts})" if title else ""
-                        chunk_specs.append((sub_start, sub_segs, sub_title))
-                else:
-                    chunk_specs.append((start_idx, chunk_segs, title))
-        else:
-            CHUNK_SIZE = HIGHLIGHT_FALLBACK_CHUNK_SIZE
-            for i in range(0, len(segments), CHUNK_SIZE):
-                chunk_segs = segments[i:i + CHUNK_SIZE]
-                chunk_specs.append((i, chunk_segs, ""))
+        max_tokens = chunk_input_budget(HIGHLIGHTS_MODELS, HIGHLIGHTS_CHUNK_BUDGET)
+        chunk_specs = plan_chunks(segments, max_tokens, request.chapters)
 
         total_chunks = len(chunk_specs)
 
-        # 检查 per-chunk 缓存
+        # 检查 per-chunk 缓存（一次查询取回所有 chunk）
+        chunk_cache = await aget_many(request.video_id, [
+            _segmented(f"highlights_ch_{start_idx}_{len(chunk_segs)}") for start_idx, chunk_segs, _ in chunk_specs
+        ]) if request.video_id else {}
         cached_results: dict[int, dict] = {}
         uncached_specs: list[tuple[int, list[dict], str]] = []
         for (start_idx, chunk_segs, title) in chunk_specs:
-            if request.video_id:
-                chunk_key = f"highlights_ch_{start_idx}_{len(chunk_segs)}"
-                chunk_cached = get_cache(request.video_id, chunk_key)
-                if chunk_cached is not None:
-                    cached_results[start_idx] = chunk_cached
-                    continue
+            chunk_cached = chunk_cache.get(_segmented(f"highlights_ch_{start_idx}_{len(chunk_segs)}"))
+            if chunk_cached is not None:
+                cached_results[start_idx] = chunk_cached
+                continue
             uncached_specs.append((start_idx, chunk_segs, title))
 
         # 推送缓存的 chunk
@@ -474,6 +504,16 @@ async def gen_highlights_stream(request: HighlightsRequest):
         all_chunk_results: list[dict] = list(cached_results.values())
 
         sem = asyncio.Semaphore(HIGHLIGHT_CONCURRENCY)
+        # 各 chunk 的结果和流式解析出的单条高亮都经由此队列按到达顺序推送
+        queue: asyncio.Queue[dict] = asyncio.Queue()
+
+        def push_highlight(item: dict, title: str):
+            highlights_by_seg = _postprocess_highlights([item], segments)
+            if highlights_by_seg:
+                queue.put_nowait({"event": "highlight", "data": json.dumps({
+                    "highlights": highlights_by_seg,
+                    "chapter_title": title,
+                }, ensure_ascii=False)})
 
         async def process_one_chunk(start_idx: int, chunk_segs: list[dict], title: str):
             chunk_end = start_idx + len(chunk_segs)
@@ -483,49 +523,66 @@ async def gen_highlights_stream(request: HighlightsRequest):
                 for idx, s in enumerate(chunk_segs)
             )
 
-            async with sem:
-                for attempt in range(3):
-                    try:
-                        raw = await loop.run_in_executor(
-                            _highlight_executor,
-                            generate_highlights,
-                            chunk_indexed,
-                        )
-                        highlights_by_seg = _postprocess_highlights(raw, segments)
-                        count = sum(len(v) for v in highlights_by_seg.values())
-                        print(f"Chapter {chunk_label}: {len(raw)} raw → {count} matched")
-
-                        chunk_result = {
-                            "highlights": highlights_by_seg,
-                            "count": count,
-                            "chapter_title": title,
-                        }
-
-                        # 缓存该 chunk
-                        if request.video_id:
-                            chunk_key = f"highlights_ch_{start_idx}_{len(chunk_segs)}"
-                            set_cache(request.video_id, chunk_key, chunk_result)
-
-                        return chunk_result
-                    except Exception as e:
-                        if attempt < 2:
-                            print(f"Chapter {chunk_label} attempt {attempt+1} failed, retrying: {str(e)[:100]}")
-                        else:
-                            print(f"ERROR: Chapter {chunk_label} failed after 3 attempts: {str(e)[:100]}")
-                            failed_chunks.append(title or f"[{start_idx}-{chunk_end}]")
-                            return None
-
-        # 创建所有任务，按完成顺序推送
+            # 模型 fallback 和截断续写都在 agenerate_highlights 内部处理；不再整体重试，
+            # 否则会重跑整个生成，并把客户端已收到的 highlight 事件再推一遍。
+            # 后处理和缓存写入失败同样记为失败的 chunk
+            try:
+                async with sem:
+                    raw = await agenerate_highlights(
+                        chunk_indexed, on_item=lambda item: push_highlight(item, title),
+                    )
+
+                highlights_by_seg = _postprocess_highlights(raw, segments)
+                count = sum(len(v) for v in highlights_by_seg.values())
+                print(f"Chapter {chunk_label}: {len(raw)} raw → {count} matched")
+
+                chunk_result = {
+                    "highlights": highlights_by_seg,
+                    "count": count,
+                    "chapter_title": title,
+                }
+
+                # 缓存该 chunk
+                if request.video_id:
+                    chunk_key = _segmented(f"highlights_ch_{start_idx}_{len(chunk_segs)}")
+                    await aset_cache(request.video_id, chunk_key, chunk_result)
+
+                return chunk_result
+            except Exception as e:
+                print(f"ERROR: Chapter {chunk_label} failed: {str(e)[:100]}")
+                failed_chunks.append(title or f"[{start_idx}-{chunk_end}]")
+                return None
+
+        async def run_chunk(start_idx: int, chunk_segs: list[dict], title: str):
+            result = None
+            try:
+                result = await process_one_chunk(start_idx, chunk_segs, title)
+            finally:
+                # 不论结果如何都要入队（None 表示失败），否则消费端会一直等这个 chunk，流永远不结束
+                queue.put_nowait({"event": "chunk_result", "result": result})
+
+        # 创建所有任务，按到达顺序推送：单条高亮随生成随推，chunk 完成后推送完整结果
         tasks = [
-            asyncio.create_task(process_one_chunk(si, cs, t))
+            asyncio.create_task(run_chunk(si, cs, t))
             for si, cs, t in uncached_specs
         ]
 
-        for coro in asyncio.as_completed(tasks):
-            result = await coro
-            if result:
-                all_chunk_results.append(result)
-                yield {"event": "chunk_result", "data": json.dumps(result, ensure_ascii=False)}
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                if event["event"] != "chunk_result":
+                    yield event
+                    continue
+                remaining -= 1
+                result = event["result"]
+                if result:
+                    all_chunk_results.append(result)
+                    yield {"event": "chunk_result", "data": json.dumps(result, ensure_ascii=False)}
+        finally:
+            # 客户端断开时取消仍在进行的 chunk
+            for task in tasks:
+                task.cancel()
 
         # 计算总数
         total_count = sum(r.get("count", r.get("total", 0)) for r in all_chunk_results)
@@ -537,7 +594,7 @@ async def gen_highlights_stream(request: HighlightsRequest):
                 for seg_idx_str, hl_list in r.get("highlights", {}).items():
                     merged.setdefault(str(seg_idx_str), []).extend(hl_list)
             full_result = {"highlights": merged, "total": total_count}
-            set_cache(request.video_id, "highlights", full_result)
+            await aset_cache(request.video_id, _segmented("highlights"), full_result)
 
         yield {"event": "done", "data": json.dumps({
             "total": total_count,
@@ -546,3 +603,99 @@ async def gen_highlights_stream(request: HighlightsRequest):
         })}
 
     return EventSourceResponse(event_generator())
+
+
+class LiveAppendRequest(BaseModel):
+    video_id: str
+    segments: list[dict]  # 新到达的原始字幕 [{text, start, duration}]
+    final: bool = False   # 直播结束，剩余内容全部定稿
+
+
+@router.post("/api/transcript/live")
+async def append_live_transcript(request: LiveAppendRequest):
+    """
+    直播 / 首映增量处理 — SSE：追加原始字幕，推送新定稿的段落，再只为新凑满的 chunk 生成 AI 高亮和注释
+
+    事件: segments {start_idx, segments, total_segments, dictionary_version}
+    → chunk_result {highlights, count, chapter_title} / notes {notes} 按完成顺序 → done
+    """
+    live = get_session(request.video_id)
+    update = live.append(request.segments, request.final)
+    if request.final:
+        end_session(request.video_id)
+    # AI 结果里的 segment_index 是全局下标，这里固定住当前段落列表
+    segments = list(live.segments)
+
+    async def live_highlights(start_idx: int, chunk_segs: list[dict]) -> dict:
+        chunk_indexed = "\n".join(f"[{start_idx + idx}] {s.get('text', '')}" for idx, s in enumerate(chunk_segs))
+        raw = await agenerate_highlights(chunk_indexed)
+        highlights_by_seg = _postprocess_highlights(raw, segments)
+        count = sum(len(v) for v in highlights_by_seg.values())
+        return {"event": "chunk_result", "data": json.dumps({
+            "highlights": highlights_by_seg,
+            "count": count,
+            "chapter_title": "",
+        }, ensure_ascii=False)}
+
+    async def live_notes(start_idx: int, chunk_segs: list[dict]) -> dict:
+        chunk_indexed = "\n".join(f"[{start_idx + idx}] {s.get('text', '')}" for idx, s in enumerate(chunk_segs))
+        notes = await agenerate_context_notes(chunk_indexed)
+        chunk_end = start_idx + len(chunk_segs)
+        notes = [n for n in notes if start_idx <= n.get("segment_index", -1) < chunk_end]
+        return {"event": "notes", "data": json.dumps({"notes": notes}, ensure_ascii=False)}
+
+    # 还没生成成功的 chunk；请求结束时（出错、客户端断开）放回会话，下次追加时重试
+    unfinished = {
+        (task, start_idx): chunk_segs
+        for task, task_chunks in update["chunks"].items()
+        for start_idx, chunk_segs in task_chunks
+    }
+
+    async def event_generator():
+        jobs: list[asyncio.Task] = []
+        try:
+            yield {"event": "segments", "data": json.dumps({
+                "start_idx": update["start_idx"],
+                "segments": update["segments"],
+                "total_segments": len(segments),
+                "dictionary_version": live.dictionary.version,
+            }, ensure_ascii=False)}
+
+            sem = asyncio.Semaphore(HIGHLIGHT_CONCURRENCY)
+            failed_chunks: list[str] = []
+
+            async def run(task: str, generate, start_idx: int, chunk_segs: list[dict]):
+                async with sem:
+                    try:
+                        event = await generate(start_idx, chunk_segs)
+                    except Exception as e:
+                        label = f"{task} [{start_idx}-{start_idx + len(chunk_segs)}]"
+                        print(f"ERROR: Live {request.video_id} {label} failed: {str(e)[:100]}")
+                        failed_chunks.append(label)
+                        return None
+                    del unfinished[(task, start_idx)]
+                    return event
+
+            jobs = [
+                asyncio.create_task(run(task, generate, start_idx, chunk_segs))
+                for task, generate in (("highlights", live_highlights), ("context_notes", live_notes))
+                for start_idx, chunk_segs in update["chunks"][task]
+            ]
+            for finished in asyncio.as_completed(jobs):
+                event = await finished
+                if event:
+                    yield event
+
+            yield {"event": "done", "data": json.dumps({
+                "total_segments": len(segments),
+                "final": request.final,
+                "failed_chunks": failed_chunks,
+            })}
+        finally:
+            # 客户端断开时取消仍在进行的 chunk
+            for job in jobs:
+                job.cancel()
+            for (task, start_idx), chunk_segs in unfinished.items():
+                live.requeue(task, start_idx, chunk_segs)
+
+    return EventSourceResponse(event_generator())
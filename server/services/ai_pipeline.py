@@ -5,12 +5,25 @@ AI Pipeline — 从 run_breakdown.py 提取的核心逻辑
 
 import os
 import re
+import json
+import time
+import asyncio
+import hashlib
 from pathlib import Path
 from datetime import datetime
-from typing import Generator
+from typing import AsyncGenerator, Callable
 
 from dotenv import load_dotenv
 
+from server.services.llm_clients import (
+    get_async_client,
+    get_async_openai_client,
+)
+from server.services import provider_health
+from server.services.cache_store import aget_llm_cache, aset_llm_cache
+from server.services.json_stream import JsonArrayStream, parse_json_array
+from server.services.transcript_fetch import merge_segments
+
 # --------------- 配置 ---------------
 
 PROJECT_DIR = Path(__file__).parent.parent.parent
@@ -30,6 +43,11 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+
+# ToC / Context Notes / Highlights 是否向 provider 传 JSON Schema 约束输出（设为 0 退回纯 prompt 约束）
+STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") != "0"
+
 OUTPUT_DIR = PROJECT_DIR / "output"
 PERSONAS_DIR = PROJECT_DIR / "personas"
 
@@ -46,8 +64,70 @@ STEP2_MODELS = [
     ("openai", "gpt-4o"),
 ]
 
+# 每次调用请求的最大输出 token 数（call_* 的默认 max_tokens）
+DEFAULT_MAX_TOKENS = 16000
+
+# 各模型的 (上下文窗口, 最大输出) token 上限，用于规划 chunk 大小
+MODEL_LIMITS = {
+    "gemini-2.5-pro": (1_048_576, 65_536),
+    "gemini-2.5-flash": (1_048_576, 65_536),
+    "gpt-4o": (128_000, 16_384),
+    "gpt-4o-mini": (128_000, 16_384),
+    "claude-sonnet-4-20250514": (200_000, 64_000),
+}
+
+# 长 transcript 的 Map-Reduce：估算超过 LONG_TRANSCRIPT_TOKENS 时，按段落边界切成
+# 约 MAP_CHUNK_TOKENS 的 chunk 并行提取要点（MAP_MODELS），再用要点代替原文做 Step 1 / 2
+LONG_TRANSCRIPT_TOKENS = 30000
+MAP_CHUNK_TOKENS = 10000
+MAP_CONCURRENCY = 4
+
+MAP_MODELS = [
+    ("gemini", "gemini-2.5-flash"),
+    ("openai", "gpt-4o-mini"),
+    ("anthropic", "claude-sonnet-4-20250514"),
+]
+
+# 对冲策略（仅异步调用生效）：当前模型耗时超过其近期延迟的 percentile 分位数
+# 仍未返回时，并行发起下一个模型，取先成功的结果并取消其余请求。
+# 分位数夹在 [min_delay, max_delay] 之间；历史样本不足时用 default_delay。
+# None 表示不对冲，严格按顺序 fallback。
+STEP1_HEDGE = None
+STEP2_HEDGE = None
+MAP_HEDGE = {"percentile": 90, "min_delay": 10.0, "max_delay": 120.0, "default_delay": 60.0}
+
 # --------------- Prompt 模板 ---------------
 
+# 所有 prompt 都拆成「可缓存前缀 + 任务说明」两部分：transcript 放在最前面，
+# 同一份 transcript 的多次调用（Step 1 / Step 2，同一 chunk 的 context notes /
+# highlights）共享完全相同的前缀，可以命中 provider 侧的 prompt caching。
+# 前缀之前只有 system，因此共享前缀的调用也必须使用同一条 system。
+
+PIPELINE_SYSTEM = "你是一个深度理解用户痛点、专注于双语视频学习内容的内容顾问。"
+
+TRANSCRIPT_PREFIX = """# Video Transcript
+以下是一期 YouTube 视频的文字稿（英文）：
+
+{transcript}"""
+
+MAP_SYSTEM = "你是一个细致的视频内容整理助手。"
+
+MAP_PROMPT = """# Task
+上面是一期长视频文字稿的第 {part}/{total} 部分（按时间顺序）。原文太长，后续分析会用各部分的要点代替原文，
+请为这一部分提取完整的素材，不要遗漏具体的例子、数字和话术：
+
+1. **本部分主题**：1-2 句话概括
+2. **关键技巧 / 观点**：逐条列出，每条附 1 句最能代表它的英文原文引用
+3. **值得学习的英文表达**：英文原文 + 中文意思
+4. **背景知识**：视频默认观众知道的书、概念、人物、术语
+
+用中文输出（英文原文保留），精炼但信息完整。"""
+
+MAP_REDUCE_PREFIX = """# Video Transcript Notes
+这期 YouTube 视频很长，以下是按时间顺序逐段提取的要点（代替原文，英文引用为视频原话）：
+
+{notes}"""
+
 STEP1_PROMPT = """# Role
 你是一个深度理解目标用户痛点的内容顾问。你的核心能力是：把一个英文专业视频的内容，翻译成"这和用户有什么关系"。
 
@@ -55,7 +135,7 @@ STEP1_PROMPT = """# Role
 {persona}
 
 # Task
-以下是一期 YouTube 视频的文字稿（英文）。请分析：
+请基于上面的视频文字稿分析：
 
 1. **一句话价值**：这期视频对上述用户画像的核心价值是什么？（用一句直击内心的话概括）
 
@@ -70,9 +150,6 @@ STEP1_PROMPT = """# Role
 
 4. **明天行动**：用户看完后，明天最该做的一件事是什么？
 
-# Video Transcript
-{transcript}
-
 # Output Requirements
 - 用中文回答
 - 语气像一个有 5 年经验的同行在和新人聊天，不要像老师讲课
@@ -88,7 +165,7 @@ STEP2_PROMPT = """# Role
 {persona}
 
 # Layer 0 Analysis (来自上一步的分析)
-以下是对这期视频对目标用户价值的分析，请基于此展开深度拆解：
+以下是对上面这期视频对目标用户价值的分析，请基于此展开深度拆解：
 
 {layer0}
 
@@ -143,9 +220,6 @@ STEP2_PROMPT = """# Role
 - ⚡ "明天就做"（1 个具体行动）
 - 📖 延伸阅读（视频默认你知道的书/概念）
 
-# Video Transcript
-{transcript}
-
 # Tone & Format
 - 中文为主，英文关键表达保留原文
 - 语气：有经验的同行分享，不是教科书
@@ -153,27 +227,180 @@ STEP2_PROMPT = """# Role
 - 表格用于对比，code block 用于模板/速查卡"""
 
 
-# --------------- API 调用 ---------------
+# --------------- Messages 格式 ---------------
+#
+# message["content"] 可以是字符串，也可以是文本块列表：
+#     [{"type": "text", "text": "...", "cache": True}, {"type": "text", "text": "..."}]
+# "cache": True 标记可缓存前缀（只支持第一条 user 消息开头的连续块），各 provider 据此
+# 做 prompt caching：Anthropic 加 cache_control，OpenAI 对相同前缀自动缓存，
+# Gemini 依赖 2.5 系列的隐式缓存。前缀块再带 "shared": True（确定会被后续请求复用，
+# 如 Step 1 / 2 共用的 transcript）且足够长时，Gemini 额外建显式 cachedContents。
+
+def prefixed_messages(system: str, prefix: str, prompt: str, shared: bool = False) -> list[dict]:
+    """system + 可缓存前缀（通常是 transcript）+ 任务 prompt；shared 见上"""
+    prefix_block = {"type": "text", "text": prefix, "cache": True}
+    if shared:
+        prefix_block["shared"] = True
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": [
+            prefix_block,
+            {"type": "text", "text": prompt},
+        ]},
+    ]
 
-def call_gemini(messages: list, model: str, max_tokens: int = 16000) -> str:
-    import requests
 
-    if not GEMINI_API_KEY:
-        raise RuntimeError("GEMINI_API_KEY 未配置")
+def _blocks(content) -> list[dict]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return content
+
+
+def _message_text(content) -> str:
+    return "\n\n".join(block["text"] for block in _blocks(content))
+
+
+def _split_cached_prefix(messages: list) -> tuple[str | None, str, list]:
+    """拆出 (system, 可缓存前缀文本, 去掉 system 和前缀之后的 messages)"""
+    system = None
+    prefix_parts = []
+    rest = []
+    for msg in messages:
+        if msg["role"] == "system":
+            system = _message_text(msg["content"])
+            continue
+        if not prefix_parts and not rest and msg["role"] == "user":
+            blocks = _blocks(msg["content"])
+            while blocks and blocks[0].get("cache"):
+                prefix_parts.append(blocks[0]["text"])
+                blocks = blocks[1:]
+            if blocks:
+                rest.append({"role": "user", "content": blocks})
+            continue
+        rest.append(msg)
+    return system, "\n\n".join(prefix_parts), rest
+
+
+# --------------- Gemini 显式上下文缓存（cachedContents） ---------------
 
+# 只为标记了 shared 的前缀建显式缓存（创建本身要计费和多一次往返，只用一次不划算）；
+# 前缀短于此字符数（约 8k tokens）时也不建，靠 Gemini 2.5 的隐式缓存
+GEMINI_EXPLICIT_CACHE_MIN_CHARS = 32000
+GEMINI_CACHE_TTL_SECONDS = 600
+
+# 缓存键 → (cachedContents 名称或 None, 过期时间)；None 表示创建失败，过期前不再重试。
+# 每次写入时清掉已过期的记录
+_gemini_cache_names: dict[str, tuple[str | None, float]] = {}
+
+
+def _has_shared_prefix(messages: list) -> bool:
+    for msg in messages:
+        if msg["role"] == "user":
+            blocks = _blocks(msg["content"])
+            return bool(blocks) and bool(blocks[0].get("shared"))
+    return False
+
+
+def _gemini_cache_plan(messages: list, model: str) -> tuple[str, dict, list] | None:
+    """需要显式缓存时返回 (缓存键, cachedContents 创建请求体, 剩余 messages)"""
+    if not _has_shared_prefix(messages):
+        return None
+    system, prefix, rest = _split_cached_prefix(messages)
+    if len(prefix) < GEMINI_EXPLICIT_CACHE_MIN_CHARS:
+        return None
+
+    key = hashlib.sha256(f"{model}\0{system or ''}\0{prefix}".encode("utf-8")).hexdigest()
+    body = {
+        "model": f"models/{model}",
+        "contents": [{"role": "user", "parts": [{"text": prefix}]}],
+        "ttl": f"{GEMINI_CACHE_TTL_SECONDS}s",
+    }
+    if system:
+        body["systemInstruction"] = {"parts": [{"text": system}]}
+    return key, body, rest
+
+
+def _gemini_cache_lookup(key: str) -> tuple[bool, str | None]:
+    """返回 (是否有未过期记录, 缓存名称)"""
+    entry = _gemini_cache_names.get(key)
+    if entry is None or entry[1] <= time.monotonic():
+        return False, None
+    return True, entry[0]
+
+
+def _gemini_cache_store(key: str, response) -> str | None:
+    now = time.monotonic()
+    for expired in [k for k, (_, expires_at) in _gemini_cache_names.items() if expires_at <= now]:
+        del _gemini_cache_names[expired]
+    if response.status_code == 200:
+        name = response.json()["name"]
+        # 提前 30 秒视为过期，避免用到刚好失效的缓存
+        _gemini_cache_names[key] = (name, now + GEMINI_CACHE_TTL_SECONDS - 30)
+        return name
+    print(f"Gemini cachedContents 创建失败（{response.status_code}），本次不用显式缓存")
+    _gemini_cache_names[key] = (None, now + GEMINI_CACHE_TTL_SECONDS)
+    return None
+
+
+# --------------- 结构化输出（JSON Schema） ---------------
+
+# OpenAI strict 模式和 Anthropic tool 的 schema 根节点必须是 object，
+# 数组结果包一层 {"items": [...]}（parse_json_array 会自动拆开）
+STRUCTURED_ITEMS_KEY = "items"
+STRUCTURED_TOOL_NAME = "emit_result"
+
+
+def _object_root_schema(schema: dict) -> dict:
+    if schema.get("type") == "object":
+        return schema
+    return {
+        "type": "object",
+        "properties": {STRUCTURED_ITEMS_KEY: schema},
+        "required": [STRUCTURED_ITEMS_KEY],
+        "additionalProperties": False,
+    }
+
+
+def _gemini_schema(schema: dict) -> dict:
+    """
+    JSON Schema → Gemini responseSchema（OpenAPI 子集）：
+    类型名大写，["string", "null"] 改为 nullable，去掉不支持的 additionalProperties
+    """
+    result = {}
+    for key, value in schema.items():
+        if key == "additionalProperties":
+            continue
+        if key == "type":
+            types = value if isinstance(value, list) else [value]
+            non_null = [t for t in types if t != "null"]
+            result["type"] = non_null[0].upper()
+            if len(non_null) < len(types):
+                result["nullable"] = True
+        elif key == "properties":
+            result[key] = {name: _gemini_schema(sub) for name, sub in value.items()}
+        elif key == "items":
+            result[key] = _gemini_schema(value)
+        else:
+            result[key] = value
+    return result
+
+
+# --------------- API 调用 ---------------
+
+def _gemini_payload(
+    messages: list, max_tokens: int, cached_content: str | None = None, schema: dict | None = None,
+) -> dict:
     contents = []
     system_instruction = None
 
     for msg in messages:
         role = msg["role"]
         if role == "system":
-            system_instruction = msg["content"]
+            system_instruction = _message_text(msg["content"])
             continue
         if role == "assistant":
             role = "model"
-        contents.append({"role": role, "parts": [{"text": msg["content"]}]})
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
+        contents.append({"role": role, "parts": [{"text": block["text"]} for block in _blocks(msg["content"])]})
 
     payload = {
         "contents": contents,
@@ -181,50 +408,35 @@ def call_gemini(messages: list, model: str, max_tokens: int = 16000) -> str:
             "maxOutputTokens": max_tokens,
         },
     }
+    if schema is not None:
+        payload["generationConfig"]["responseMimeType"] = "application/json"
+        payload["generationConfig"]["responseSchema"] = _gemini_schema(schema)
 
-    if system_instruction:
+    if cached_content:
+        payload["cachedContent"] = cached_content
+    elif system_instruction:
         payload["systemInstruction"] = {
             "parts": [{"text": system_instruction}]
         }
+    return payload
 
-    response = requests.post(url, json=payload, timeout=600)
-
-    if response.status_code != 200:
-        error_info = response.json().get("error", {}).get("message", response.text)
-        raise RuntimeError(f"Gemini {model}: {response.status_code} - {error_info}")
-
-    data = response.json()
-    return data["candidates"][0]["content"]["parts"][0]["text"]
-
-
-def call_openai(messages: list, model: str, max_tokens: int = 16000) -> str:
-    from openai import OpenAI
-
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY 未配置")
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-    )
-    return response.choices[0].message.content
-
-
-def call_anthropic(messages: list, model: str, max_tokens: int = 16000) -> str:
-    import requests
-
-    if not ANTHROPIC_API_KEY:
-        raise RuntimeError("ANTHROPIC_API_KEY 未配置")
 
+def _anthropic_request(messages: list, model: str, max_tokens: int, schema: dict | None = None) -> tuple[dict, dict]:
     system_content = ""
     api_messages = []
     for msg in messages:
         if msg["role"] == "system":
-            system_content = msg["content"]
-        else:
+            system_content = _message_text(msg["content"])
+        elif isinstance(msg["content"], str):
             api_messages.append(msg)
+        else:
+            content = []
+            for block in msg["content"]:
+                api_block = {"type": "text", "text": block["text"]}
+                if block.get("cache"):
+                    api_block["cache_control"] = {"type": "ephemeral"}
+                content.append(api_block)
+            api_messages.append({"role": msg["role"], "content": content})
 
     headers = {
         "x-api-key": ANTHROPIC_API_KEY,
@@ -239,44 +451,533 @@ def call_anthropic(messages: list, model: str, max_tokens: int = 16000) -> str:
     }
     if system_content:
         payload["system"] = system_content
+    if schema is not None:
+        # 强制调用唯一的 tool，tool 的输入即结构化结果
+        payload["tools"] = [{
+            "name": STRUCTURED_TOOL_NAME,
+            "description": "Return the result.",
+            "input_schema": _object_root_schema(schema),
+        }]
+        payload["tool_choice"] = {"type": "tool", "name": STRUCTURED_TOOL_NAME}
+    return headers, payload
+
+
+def _openai_response_format(schema: dict | None) -> dict:
+    if schema is None:
+        return {}
+    return {"response_format": {
+        "type": "json_schema",
+        "json_schema": {"name": STRUCTURED_TOOL_NAME, "strict": True, "schema": _object_root_schema(schema)},
+    }}
+
+
+def _anthropic_text(data: dict) -> str:
+    """文本回复取第一个 text 块；结构化输出取 tool_use 块的输入"""
+    for block in data.get("content", []):
+        if block.get("type") == "tool_use":
+            return json.dumps(block.get("input", {}), ensure_ascii=False)
+        if block.get("type") == "text":
+            return block["text"]
+    return ""
+
+
+def _openai_messages(messages: list) -> list[dict]:
+    """OpenAI 对相同前缀自动缓存，只需把文本块拼回字符串"""
+    return [{"role": msg["role"], "content": _message_text(msg["content"])} for msg in messages]
+
+
+def _report_gemini_usage(model: str, data: dict):
+    meta = data.get("usageMetadata")
+    if meta:
+        provider_health.record_usage(
+            f"gemini/{model}", meta.get("promptTokenCount", 0), meta.get("cachedContentTokenCount", 0),
+        )
+
+
+def _report_anthropic_usage(model: str, usage: dict):
+    if usage:
+        cached = usage.get("cache_read_input_tokens") or 0
+        total = (usage.get("input_tokens") or 0) + cached + (usage.get("cache_creation_input_tokens") or 0)
+        provider_health.record_usage(f"anthropic/{model}", total, cached)
+
+
+def _report_openai_usage(model: str, usage):
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        provider_health.record_usage(f"openai/{model}", usage.prompt_tokens, cached)
+
+
+# 各 provider 表示"输出达到 max_tokens 被截断"的 finish reason
+TRUNCATION_REASONS = {
+    "MAX_TOKENS",   # Gemini finishReason
+    "max_tokens",   # Anthropic stop_reason
+    "length",       # OpenAI finish_reason
+}
 
-    response = requests.post(
+
+class OutputTruncated(RuntimeError):
+    """
+    模型输出在 max_tokens 处被截断。content 为已生成的部分，label 为 "provider/model"
+
+    这不是 provider 故障：fallback 不会换模型重试，而是把部分输出交给调用方续写
+    """
+
+    def __init__(self, model: str, content: str = ""):
+        super().__init__(f"{model}: 输出达到 max_tokens 被截断")
+        self.content = content
+        self.label = ""
+
+
+def _check_finish(model: str, reason: str | None, content: str = ""):
+    if reason in TRUNCATION_REASONS:
+        raise OutputTruncated(model, content)
+
+
+def _gemini_text(model: str, data: dict) -> str:
+    candidate = data["candidates"][0]
+    parts = candidate.get("content", {}).get("parts", [])
+    text = parts[0].get("text", "") if parts else ""
+    _check_finish(model, candidate.get("finishReason"), text)
+    return text
+
+
+async def _aiter_sse_data(response) -> AsyncGenerator[dict, None]:
+    """逐行解析 SSE 响应体（httpx 流式响应），yield 每条 data: 后面的 JSON"""
+    async for line in response.aiter_lines():
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            continue
+        yield json.loads(data)
+
+
+async def _agemini_cached_content(messages: list, model: str) -> tuple[str | None, list]:
+    """尝试复用 / 创建显式缓存，返回 (cachedContent 名称, 实际要发送的 messages)"""
+    plan = _gemini_cache_plan(messages, model)
+    if plan is None:
+        return None, messages
+    key, body, rest = plan
+
+    known, name = _gemini_cache_lookup(key)
+    if not known:
+        response = await get_async_client("gemini").post(
+            f"{GEMINI_API_BASE}/cachedContents?key={GEMINI_API_KEY}",
+            json=body,
+        )
+        name = _gemini_cache_store(key, response)
+    return (name, rest) if name else (None, messages)
+
+
+async def acall_gemini(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> str:
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY 未配置")
+
+    cached_content, messages = await _agemini_cached_content(messages, model)
+    url = f"{GEMINI_API_BASE}/models/{model}:generateContent?key={GEMINI_API_KEY}"
+    payload = _gemini_payload(messages, max_tokens, cached_content, schema)
+
+    response = await get_async_client("gemini").post(url, json=payload)
+
+    if response.status_code != 200:
+        error_info = response.json().get("error", {}).get("message", response.text)
+        raise RuntimeError(f"Gemini {model}: {response.status_code} - {error_info}")
+
+    data = response.json()
+    _report_gemini_usage(model, data)
+    return _gemini_text(model, data)
+
+
+async def acall_openai(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> str:
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY 未配置")
+
+    client = get_async_openai_client()
+    response = await client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(messages),
+        max_tokens=max_tokens,
+        **_openai_response_format(schema),
+    )
+    _report_openai_usage(model, response.usage)
+    choice = response.choices[0]
+    _check_finish(model, choice.finish_reason, choice.message.content or "")
+    return choice.message.content
+
+
+async def acall_anthropic(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> str:
+    if not ANTHROPIC_API_KEY:
+        raise RuntimeError("ANTHROPIC_API_KEY 未配置")
+
+    headers, payload = _anthropic_request(messages, model, max_tokens, schema)
+
+    response = await get_async_client("anthropic").post(
         "https://api.anthropic.com/v1/messages",
         headers=headers,
         json=payload,
-        timeout=600,
     )
 
     if response.status_code != 200:
         raise RuntimeError(f"Claude {model}: {response.status_code} - {response.text[:200]}")
 
     data = response.json()
-    return data["content"][0]["text"]
+    _report_anthropic_usage(model, data.get("usage"))
+    text = _anthropic_text(data)
+    _check_finish(model, data.get("stop_reason"), text)
+    return text
+
+
+# --------------- 流式 API 调用（yield 文本增量） ---------------
+
+async def astream_gemini(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> AsyncGenerator[str, None]:
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY 未配置")
+
+    cached_content, messages = await _agemini_cached_content(messages, model)
+    url = f"{GEMINI_API_BASE}/models/{model}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+    payload = _gemini_payload(messages, max_tokens, cached_content, schema)
+
+    async with get_async_client("gemini").stream("POST", url, json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            error_info = response.json().get("error", {}).get("message", response.text)
+            raise RuntimeError(f"Gemini {model}: {response.status_code} - {error_info}")
+
+        last = {}
+        finish_reason = None
+        async for data in _aiter_sse_data(response):
+            last = data
+            for candidate in data.get("candidates", [])[:1]:
+                finish_reason = candidate.get("finishReason") or finish_reason
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+        _report_gemini_usage(model, last)
+        _check_finish(model, finish_reason)
+
+
+async def astream_openai(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> AsyncGenerator[str, None]:
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY 未配置")
+
+    client = get_async_openai_client()
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=_openai_messages(messages),
+        max_tokens=max_tokens,
+        **_openai_response_format(schema),
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    finish_reason = None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        if chunk.choices and chunk.choices[0].finish_reason:
+            finish_reason = chunk.choices[0].finish_reason
+        if getattr(chunk, "usage", None) is not None:
+            _report_openai_usage(model, chunk.usage)
+    _check_finish(model, finish_reason)
+
+
+async def astream_anthropic(messages: list, model: str, max_tokens: int = DEFAULT_MAX_TOKENS, schema: dict | None = None) -> AsyncGenerator[str, None]:
+    if not ANTHROPIC_API_KEY:
+        raise RuntimeError("ANTHROPIC_API_KEY 未配置")
+
+    headers, payload = _anthropic_request(messages, model, max_tokens, schema)
+    payload["stream"] = True
+
+    async with get_async_client("anthropic").stream(
+        "POST",
+        "https://api.anthropic.com/v1/messages",
+        headers=headers,
+        json=payload,
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise RuntimeError(f"Claude {model}: {response.status_code} - {response.text[:200]}")
+
+        finish_reason = None
+        async for data in _aiter_sse_data(response):
+            if data.get("type") == "error":
+                raise RuntimeError(f"Claude {model}: {data.get('error', {}).get('message', data)}")
+            if data.get("type") == "message_start":
+                _report_anthropic_usage(model, data.get("message", {}).get("usage"))
+            if data.get("type") == "content_block_delta":
+                delta = data.get("delta", {})
+                if delta.get("type") == "text_delta" and delta.get("text"):
+                    yield delta["text"]
+                elif delta.get("type") == "input_json_delta" and delta.get("partial_json"):
+                    yield delta["partial_json"]
+            if data.get("type") == "message_delta":
+                finish_reason = data.get("delta", {}).get("stop_reason") or finish_reason
+        _check_finish(model, finish_reason)
 
 
 PROVIDER_CALLERS = {
-    "gemini": call_gemini,
-    "openai": call_openai,
-    "anthropic": call_anthropic,
+    "gemini": acall_gemini,
+    "openai": acall_openai,
+    "anthropic": acall_anthropic,
+}
+
+PROVIDER_STREAMERS = {
+    "gemini": astream_gemini,
+    "openai": astream_openai,
+    "anthropic": astream_anthropic,
 }
 
 
-def call_with_fallback(messages: list, model_priority: list, step_name: str) -> tuple[str, str]:
+async def _acall_timed(
+    provider: str,
+    model: str,
+    messages: list,
+    schema: dict | None = None,
+    on_delta: Callable[[str, str], None] | None = None,
+    validate: Callable[[str], object] | None = None,
+) -> str:
+    """
+    调用单个模型并把结果记入 provider_health（调用方已 acquire）；on_delta 时走流式接口。
+    空响应、validate 抛出异常都视为该模型失败，对冲和顺序 fallback 都经由这里，行为一致
+    """
+    label = f"{provider}/{model}"
+    started = time.monotonic()
+    parts = []
+    try:
+        if on_delta is None:
+            content = await PROVIDER_CALLERS[provider](messages, model, schema=schema)
+        else:
+            async for text in PROVIDER_STREAMERS[provider](messages, model, schema=schema):
+                parts.append(text)
+                on_delta(text, label)
+            content = "".join(parts)
+        if not content or not content.strip():
+            raise RuntimeError("空响应")
+        if validate is not None:
+            validate(content)
+    except asyncio.CancelledError:
+        provider_health.release(label)
+        raise
+    except OutputTruncated as e:
+        provider_health.record_success(label, time.monotonic() - started)
+        e.content = e.content or "".join(parts)
+        e.label = label
+        raise
+    except Exception:
+        provider_health.record_failure(label)
+        raise
+    provider_health.record_success(label, time.monotonic() - started)
+    return content
+
+
+def _hedge_delay(label: str, hedge: dict) -> float:
+    delay = provider_health.latency_percentile(label, hedge["percentile"])
+    if delay is None:
+        return hedge["default_delay"]
+    return min(max(delay, hedge["min_delay"]), hedge["max_delay"])
+
+
+async def _acall_hedged(
+    messages: list,
+    model_priority: list,
+    step_name: str,
+    hedge: dict,
+    schema: dict | None = None,
+    validate: Callable[[str], object] | None = None,
+) -> tuple[str, str]:
+    """
+    对冲调用：先发起第一个模型；它超过对冲延迟仍未返回、或失败时，发起下一个。
+    多个请求同时在途时取第一个成功的结果，取消其余请求。
+    """
     errors = []
-    for provider, model in model_priority:
+    pending: dict[asyncio.Task, str] = {}
+    # 先跳过熔断中的模型，剩下的按健康度排序后依次发起
+    candidates = []
+    for provider, model in provider_health.order_models(model_priority):
+        if provider_health.acquire(f"{provider}/{model}"):
+            candidates.append((provider, model))
+        else:
+            errors.append(f"{provider}/{model}: 熔断中，跳过")
+    next_idx = 0
+    last_label = ""
+
+    def launch():
+        nonlocal next_idx, last_label
+        provider, model = candidates[next_idx]
+        next_idx += 1
+        last_label = f"{provider}/{model}"
+        pending[asyncio.create_task(_acall_timed(provider, model, messages, schema, validate=validate))] = last_label
+
+    if candidates:
+        launch()
+    try:
+        while pending:
+            timeout = _hedge_delay(last_label, hedge) if next_idx < len(candidates) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # 超过对冲延迟，并行发起下一个模型
+                print(f"[{step_name}] {last_label} 超过 {timeout:.1f}s 未返回，对冲发起下一个模型")
+                launch()
+                continue
+
+            for task in done:
+                label = pending.pop(task)
+                try:
+                    return task.result(), label
+                except OutputTruncated:
+                    raise
+                except Exception as e:
+                    errors.append(f"{label}: {str(e)[:150]}")
+
+            if not pending and next_idx < len(candidates):
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+        # 预先 acquire 但没有发起的模型，归还 half_open 探测名额
+        for provider, model in candidates[next_idx:]:
+            provider_health.release(f"{provider}/{model}")
+
+    raise RuntimeError(
+        f"[{step_name}] 所有模型都失败:\n" + "\n".join(f"  - {e}" for e in errors)
+    )
+
+
+async def acall_with_fallback(
+    messages: list,
+    model_priority: list,
+    step_name: str,
+    on_delta: Callable[[str, str], None] | None = None,
+    hedge: dict | None = None,
+    schema: dict | None = None,
+    validate: Callable[[str], object] | None = None,
+) -> tuple[str, str]:
+    """
+    按优先级依次尝试模型，返回 (完整输出, "provider/model")
+
+    on_delta: 可选回调 on_delta(text, "provider/model")，传入时改用流式接口，
+    每收到一段文本增量就回调一次。某个模型中途失败后切换到下一个模型时，
+    model 标签会变化，调用方据此丢弃之前的增量。
+
+    hedge: 可选对冲策略（见 TOC_HEDGE），传入时模型可以重叠执行以降低尾延迟；
+    流式模式（on_delta）下不对冲
+
+    schema: 可选 JSON Schema，传入时各 provider 使用结构化输出（见 _gemini_schema / _object_root_schema）
+
+    validate: 可选校验函数，对完整输出调用，抛出异常（如解析失败的 ValueError）时算作该模型失败
+
+    模型顺序由 provider_health 按健康度动态调整，熔断中的模型直接跳过；空响应算作失败，换下一个模型。
+    输出被截断时不换模型，抛出带部分输出的 OutputTruncated。
+    """
+    if hedge is not None and on_delta is None:
+        return await _acall_hedged(messages, model_priority, step_name, hedge, schema, validate)
+
+    errors = []
+    for provider, model in provider_health.order_models(model_priority):
+        label = f"{provider}/{model}"
+        if not provider_health.acquire(label):
+            errors.append(f"{label}: 熔断中，跳过")
+            continue
         try:
-            caller = PROVIDER_CALLERS[provider]
-            content = caller(messages, model)
-            return content, f"{provider}/{model}"
+            return await _acall_timed(provider, model, messages, schema, on_delta, validate), label
+        except OutputTruncated:
+            raise
         except Exception as e:
-            error_msg = str(e)[:150]
-            errors.append(f"{provider}/{model}: {error_msg}")
+            errors.append(f"{label}: {str(e)[:150]}")
 
     raise RuntimeError(
         f"[{step_name}] 所有模型都失败:\n" + "\n".join(f"  - {e}" for e in errors)
     )
 
 
+# --------------- LLM 响应缓存 ---------------
+
+# 缓存键 = hash(messages, 模型列表, LLM_CACHE_VERSION)。prompt 模板改动会直接体现在
+# messages 里；只改了解析/后处理逻辑时递增此版本号，让旧缓存失效
+LLM_CACHE_VERSION = 1
+
+
+def _llm_cache_key(messages: list, model_priority: list, schema: dict | None = None) -> str:
+    request = {"version": LLM_CACHE_VERSION, "models": model_priority, "messages": messages}
+    if schema is not None:
+        request["schema"] = schema
+    raw = json.dumps(
+        request,
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _acache_hit(key: str, step_name: str, on_delta: Callable[[str, str], None] | None) -> tuple[str, str] | None:
+    return _report_hit(await aget_llm_cache(key), step_name, on_delta)
+
+
+def _report_hit(
+    cached: tuple[str, str] | None, step_name: str, on_delta: Callable[[str, str], None] | None,
+) -> tuple[str, str] | None:
+    if cached is None:
+        return None
+    content, model = cached
+    print(f"[{step_name}] LLM cache hit ({model})")
+    if on_delta is not None:
+        on_delta(content, model)
+    return content, model
+
+
+async def acall_cached(
+    messages: list,
+    model_priority: list,
+    step_name: str,
+    parse: Callable[[str], object] | None = None,
+    on_delta: Callable[[str, str], None] | None = None,
+    hedge: dict | None = None,
+    allow_truncated: bool = True,
+    schema: dict | None = None,
+) -> tuple[object, str]:
+    """
+    带内容寻址缓存的 acall_with_fallback，返回 (parse(content) 或 content, "provider/model")
+
+    parse: 可选解析函数，解析失败算作该模型失败、换下一个模型，坏输出不会写进缓存。
+    流式模式下命中缓存会把完整内容作为一次 on_delta 回调。
+    hedge: 同 acall_with_fallback
+    allow_truncated: 输出被截断时是否直接使用部分输出（不写缓存）；
+    False 时抛出 OutputTruncated，由调用方续写。
+    schema: 可选 JSON Schema，STRUCTURED_OUTPUT 开启时传给各 provider 约束输出格式
+    """
+    schema = schema if STRUCTURED_OUTPUT else None
+    key = _llm_cache_key(messages, model_priority, schema)
+    hit = await _acache_hit(key, step_name, on_delta)
+    truncated = False
+    # 各模型输出的解析结果，按输出内容记录（对冲时可能有多个模型都解析成功）
+    parsed: dict[str, object] = {}
+
+    def validate(text: str) -> None:
+        parsed[text] = parse(text)
+
+    if hit is not None:
+        content, model = hit
+    else:
+        try:
+            content, model = await acall_with_fallback(
+                messages, model_priority, step_name, on_delta=on_delta, hedge=hedge, schema=schema,
+                validate=validate if parse else None,
+            )
+        except OutputTruncated as e:
+            if not allow_truncated:
+                raise
+            print(f"[{step_name}] WARNING: {e.label} 输出被截断，使用部分输出")
+            content, model, truncated = e.content, e.label, True
+    if content in parsed:
+        result = parsed[content]
+    else:
+        result = parse(content) if parse else content
+    if hit is None and not truncated:
+        await aset_llm_cache(key, content, model)
+    return result, model
+
+
 # --------------- Pipeline ---------------
 
 def load_persona(persona_name: str, personas_dir: Path = None) -> str:
@@ -313,36 +1014,139 @@ def list_personas(personas_dir: Path = None) -> list[dict]:
     return personas
 
 
-def run_step1(transcript: str, persona: str) -> tuple[str, str]:
-    prompt = STEP1_PROMPT.format(persona=persona, transcript=transcript)
-    messages = [
-        {"role": "system", "content": "你是一个深度理解用户痛点的内容顾问。"},
-        {"role": "user", "content": prompt},
-    ]
-    return call_with_fallback(messages, STEP1_MODELS, "Step 1: Layer 0")
+# --------------- 长 transcript Map-Reduce ---------------
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符 / token，其余（中日韩等）约 1 字符 / token"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def split_transcript(transcript: str, max_tokens: int) -> list[str]:
+    """按 merge_segments 的段落边界（句末标点，无标点时按空格）把 transcript 切成约 max_tokens 的 chunk"""
+    max_chars = max_tokens * 4
+    paragraphs = merge_segments(
+        [{"text": transcript, "start": 0.0, "duration": 0.0}],
+        soft_max=max_chars,
+        hard_max=max_chars,
+    )
+    return [p["text"] for p in paragraphs]
+
 
+def _map_messages(chunk: str, part: int, total: int) -> list[dict]:
+    prefix = TRANSCRIPT_PREFIX.format(transcript=chunk)
+    return prefixed_messages(MAP_SYSTEM, prefix, MAP_PROMPT.format(part=part, total=total))
 
-def run_step2(transcript: str, persona: str, layer0: str) -> tuple[str, str]:
+
+def _reduce_prefix(notes: list[str]) -> str:
+    sections = [f"## Part {i}/{len(notes)}\n{note.strip()}" for i, note in enumerate(notes, 1)]
+    return MAP_REDUCE_PREFIX.format(notes="\n\n".join(sections))
+
+
+async def atranscript_prefix(transcript: str) -> str:
+    """
+    Step 1 / 2 共用的前缀：短 transcript 直接用原文；长 transcript 先并行 map 出各段要点。
+    调用方算一次后传给两步，map 只跑一次，两步的 prompt cache 前缀也完全相同
+    """
+    if estimate_tokens(transcript) <= LONG_TRANSCRIPT_TOKENS:
+        return TRANSCRIPT_PREFIX.format(transcript=transcript)
+
+    chunks = split_transcript(transcript, MAP_CHUNK_TOKENS)
+    print(f"Long transcript (~{estimate_tokens(transcript)} tokens): map-reduce over {len(chunks)} chunks")
+    sem = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def map_one(part: int) -> str:
+        messages = _map_messages(chunks[part - 1], part, len(chunks))
+        async with sem:
+            note, _ = await acall_cached(messages, MAP_MODELS, f"Map {part}/{len(chunks)}", hedge=MAP_HEDGE)
+        return note
+
+    notes = await asyncio.gather(*(map_one(part) for part in range(1, len(chunks) + 1)))
+    return _reduce_prefix(list(notes))
+
+
+# --------------- Step 1 / Step 2 ---------------
+
+def _step1_messages(prefix: str, persona: str) -> list[dict]:
+    prompt = STEP1_PROMPT.format(persona=persona)
+    return prefixed_messages(PIPELINE_SYSTEM, prefix, prompt, shared=True)
+
+
+def _step2_messages(prefix: str, persona: str, layer0: str) -> list[dict]:
     prompt = STEP2_PROMPT.format(
         persona=persona,
         layer0=layer0,
-        transcript=transcript,
     )
-    messages = [
-        {"role": "system", "content": "你是一个专注于双语视频学习内容的策划师。"},
-        {"role": "user", "content": prompt},
-    ]
-    return call_with_fallback(messages, STEP2_MODELS, "Step 2: Breakdown")
+    return prefixed_messages(PIPELINE_SYSTEM, prefix, prompt, shared=True)
+
+
+async def arun_step1(
+    prefix: str,
+    persona: str,
+    on_delta: Callable[[str, str], None] | None = None,
+) -> tuple[str, str]:
+    """prefix 为 atranscript_prefix 的结果"""
+    messages = _step1_messages(prefix, persona)
+    return await acall_cached(
+        messages, STEP1_MODELS, "Step 1: Layer 0", on_delta=on_delta, hedge=STEP1_HEDGE,
+    )
 
 
-def run_pipeline_streaming(transcript: str, persona_name: str = "外贸小白") -> Generator[dict, None, None]:
-    """流式 pipeline，yield SSE 事件"""
+async def arun_step2(
+    prefix: str,
+    persona: str,
+    layer0: str,
+    on_delta: Callable[[str, str], None] | None = None,
+) -> tuple[str, str]:
+    """prefix 同 arun_step1"""
+    messages = _step2_messages(prefix, persona, layer0)
+    return await acall_cached(
+        messages, STEP2_MODELS, "Step 2: Breakdown", on_delta=on_delta, hedge=STEP2_HEDGE,
+    )
+
+
+def _save_breakdown(persona_name: str, model1: str, model2: str, breakdown: str) -> Path:
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_persona = re.sub(r'[^\w\-]', '_', persona_name)
+
+    breakdown_path = OUTPUT_DIR / f"{timestamp}_{safe_persona}_breakdown.md"
+    breakdown_path.write_text(
+        f"# 视频拆解\n\n"
+        f"> Step 1 模型: {model1}\n"
+        f"> Step 2 模型: {model2}\n"
+        f"> 画像: {persona_name}\n"
+        f"> 时间: {datetime.now().isoformat()}\n\n"
+        f"---\n\n{breakdown}",
+        encoding="utf-8",
+    )
+    return breakdown_path
+
+
+def _step_delta(on_delta: Callable[[str, str, str], None] | None, step: str):
+    if on_delta is None:
+        return None
+    return lambda text, model: on_delta(step, text, model)
+
+
+async def arun_pipeline_streaming(
+    transcript: str,
+    persona_name: str = "外贸小白",
+    on_delta: Callable[[str, str, str], None] | None = None,
+) -> AsyncGenerator[dict, None]:
+    """
+    流式 pipeline，yield SSE 事件
+
+    on_delta: 可选回调 on_delta(step, text, "provider/model")，step 为 "layer0" / "breakdown"，
+    传入时两步都走 provider 的流式接口，模型输出的文本增量会在对应完整事件之前逐段回调
+    """
     persona = load_persona(persona_name)
 
     yield {"event": "progress", "data": "正在进行 Layer 0 价值分析..."}
 
     try:
-        layer0, model1 = run_step1(transcript, persona)
+        prefix = await atranscript_prefix(transcript)
+        layer0, model1 = await arun_step1(prefix, persona, on_delta=_step_delta(on_delta, "layer0"))
         yield {
             "event": "layer0",
             "data": {"content": layer0, "model": model1},
@@ -354,7 +1158,7 @@ def run_pipeline_streaming(transcript: str, persona_name: str = "外贸小白")
     yield {"event": "progress", "data": "正在进行 4 层深度拆解..."}
 
     try:
-        breakdown, model2 = run_step2(transcript, persona, layer0)
+        breakdown, model2 = await arun_step2(prefix, persona, layer0, on_delta=_step_delta(on_delta, "breakdown"))
         yield {
             "event": "breakdown",
             "data": {"content": breakdown, "model": model2},
@@ -364,29 +1168,181 @@ def run_pipeline_streaming(transcript: str, persona_name: str = "外贸小白")
         return
 
     # 保存到文件
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_persona = re.sub(r'[^\w\-]', '_', persona_name)
+    breakdown_path = _save_breakdown(persona_name, model1, model2, breakdown)
 
-    breakdown_path = OUTPUT_DIR / f"{timestamp}_{safe_persona}_breakdown.md"
-    breakdown_path.write_text(
-        f"# 视频拆解\n\n"
-        f"> Step 1 模型: {model1}\n"
-        f"> Step 2 模型: {model2}\n"
-        f"> 画像: {persona_name}\n"
-        f"> 时间: {datetime.now().isoformat()}\n\n"
-        f"---\n\n{breakdown}",
-        encoding="utf-8",
+    yield {"event": "done", "data": str(breakdown_path)}
+
+
+# --------------- JSON 生成（ToC / Context Notes / Highlights）共用 ---------------
+
+# context notes 和 highlights 对同一个 chunk 使用相同的 system + 前缀，共享 prompt cache
+JSON_SYSTEM = "You are a transcript analyst for language learners. Output only valid JSON."
+
+INDEXED_TRANSCRIPT_PREFIX = """## Transcript (numbered segments):
+{transcript_with_indices}"""
+
+# 输出 token 的安全系数：估算有误差，只用输出上限的这一比例来规划
+OUTPUT_SAFETY_RATIO = 0.7
+
+
+def chunk_input_budget(model_priority: list, budget: dict) -> int:
+    """
+    每个 chunk 的最大估算输入 token 数
+
+    budget: {"output_per_input", "max_input_tokens", "prompt_tokens"}
+    同时满足：预计输出（输入 × output_per_input）不超过列表中所有模型输出上限的安全比例，
+    输入 + prompt + 输出不超过最小的上下文窗口，且不超过 max_input_tokens
+    （过大的 chunk 模型容易漏掉后半段）
+    """
+    context_limit = min(MODEL_LIMITS.get(m, (128_000, DEFAULT_MAX_TOKENS))[0] for _, m in model_priority)
+    output_limit = min(
+        [DEFAULT_MAX_TOKENS] + [MODEL_LIMITS.get(m, (0, DEFAULT_MAX_TOKENS))[1] for _, m in model_priority]
     )
+    by_output = int(output_limit * OUTPUT_SAFETY_RATIO / budget["output_per_input"])
+    by_context = context_limit - budget["prompt_tokens"] - output_limit
+    return max(1, min(budget["max_input_tokens"], by_output, by_context))
 
-    yield {"event": "done", "data": str(breakdown_path)}
+
+def json_array_schema(properties: dict) -> dict:
+    """
+    元素为对象的 JSON 数组 schema。所有字段必填、不允许额外字段（OpenAI strict 模式要求），
+    可为空的字段用 {"type": ["string", "null"]}
+    """
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+    }
+
+
+def _coerce_segment_index(item: dict) -> dict:
+    """确保 segment_index 是整数"""
+    item["segment_index"] = int(item.get("segment_index", 0))
+    return item
+
+
+def _valid_items(items: list) -> list[dict]:
+    """丢掉不是对象、或 segment_index 无法转成整数的条目（如 null），其余转换后保留"""
+    valid = []
+    for item in items:
+        try:
+            valid.append(_coerce_segment_index(item))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return valid
+
+
+def _item_streamer(on_item: Callable[[dict], None]) -> Callable[[str, str], None]:
+    """
+    把 on_delta 文本增量接到 JsonArrayStream，每完成一个对象回调 on_item(obj)
+    fallback 换模型时输出从头开始，解析状态随之重置（已推送的对象由调用方去重）
+    """
+    state = {"model": None, "stream": None}
+
+    def on_delta(text: str, model: str):
+        if model != state["model"]:
+            state["model"] = model
+            state["stream"] = JsonArrayStream()
+        for item in _valid_items(state["stream"].feed(text)):
+            on_item(item)
+
+    return on_delta
+
+
+# 输出被截断后最多续写几次（每次只请求尚未覆盖的 segment）
+MAX_CONTINUATIONS = 2
+
+_INDEXED_LINE = re.compile(r'^\[(\d+)\]')
+
+
+def _merge_items(items: list[dict], new_items: list[dict], key_field: str) -> list[dict]:
+    """合并续写结果，续写从最后一个已覆盖的 segment 开始，会与之前的结果重复"""
+    seen = {(item["segment_index"], str(item.get(key_field, "")).lower()) for item in items}
+    merged = list(items)
+    for item in new_items:
+        key = (item["segment_index"], str(item.get(key_field, "")).lower())
+        if key not in seen:
+            seen.add(key)
+            merged.append(item)
+    return merged
+
+
+def _continuation_transcript(transcript_with_indices: str, partial: list[dict]) -> str | None:
+    """
+    截断后续写用的 transcript：从已输出的最大 segment_index 起（含，该 segment 可能只写了一半）
+    没有进展（一个完整对象都没有，或仍从第一行开始）时返回 None
+    """
+    if not partial:
+        return None
+    resume = max(item["segment_index"] for item in partial)
+    lines = transcript_with_indices.split("\n")
+    indices = [int(m.group(1)) if (m := _INDEXED_LINE.match(line)) else None for line in lines]
+    first = next((idx for idx in indices if idx is not None), None)
+    if first is None or resume <= first:
+        return None
+    remaining = [line for line, idx in zip(lines, indices) if idx is not None and idx >= resume]
+    return "\n".join(remaining) if remaining else None
+
+
+def _after_truncation(
+    e: OutputTruncated, step_name: str, transcript_with_indices: str, items: list[dict], key_field: str,
+) -> tuple[str | None, list[dict]]:
+    """保留截断输出中完整的对象，返回 (续写用的 transcript 或 None, 合并后的结果)"""
+    partial = _valid_items(JsonArrayStream().feed(e.content))
+    items = _merge_items(items, partial, key_field)
+    next_transcript = _continuation_transcript(transcript_with_indices, partial)
+    if next_transcript is not None:
+        resume = max(item["segment_index"] for item in partial)
+        print(f"[{step_name}] {e.label} 输出被截断，保留 {len(partial)} 条，已覆盖到 segment {resume}")
+    return next_transcript, items
+
+
+def _truncated_result(items: list[dict], step_name: str) -> list[dict]:
+    if not items:
+        raise RuntimeError(f"[{step_name}] 输出被截断且没有完整的对象")
+    print(f"[{step_name}] WARNING: 续写后仍被截断，返回已有的 {len(items)} 条")
+    return items
+
+
+async def _agenerate_items(
+    transcript_with_indices: str,
+    messages_fn: Callable[[str], list[dict]],
+    model_priority: list,
+    step_name: str,
+    parse: Callable[[str], list[dict]],
+    key_field: str,
+    on_item: Callable[[dict], None] | None,
+    hedge: dict | None,
+    schema: dict | None = None,
+) -> list[dict]:
+    """按 segment 输出 JSON 数组的生成：截断时保留完整对象，只对未覆盖的 segment 续写"""
+    items: list[dict] = []
+    transcript = transcript_with_indices
+    for _ in range(MAX_CONTINUATIONS + 1):
+        on_delta = _item_streamer(on_item) if on_item else None
+        try:
+            result, model = await acall_cached(
+                messages_fn(transcript), model_priority, step_name,
+                parse=parse, on_delta=on_delta, hedge=hedge, allow_truncated=False, schema=schema,
+            )
+            return _merge_items(items, result, key_field)
+        except OutputTruncated as e:
+            transcript, items = _after_truncation(e, step_name, transcript, items, key_field)
+            if transcript is None:
+                break
+    return _truncated_result(items, step_name)
 
 
 # --------------- ToC 目录生成 ---------------
 
-import json
+TOC_PREFIX = """## Transcript (with timestamps in [MM:SS] format):
+{transcript}"""
 
-TOC_PROMPT = """You are a content analyst. Given the following video transcript with timestamps, identify the major topic sections/chapters.
+TOC_PROMPT = """You are a content analyst. Given the video transcript with timestamps above, identify the major topic sections/chapters.
 
 For each chapter, provide:
 - "title": A concise, descriptive title in the SAME LANGUAGE as the transcript
@@ -395,8 +1351,8 @@ For each chapter, provide:
 
 Return ONLY a JSON array, no other text. Example:
 [
-  {{"title": "Introduction and Why Outbound Matters", "start_time": 0, "summary": "The speaker introduces himself and explains why outbound is essential for hitting quota."}},
-  {{"title": "Cold Email Strategy That Gets Replies", "start_time": 245, "summary": "How to write cold emails with high reply rates using buyer-centric messaging."}}
+  {"title": "Introduction and Why Outbound Matters", "start_time": 0, "summary": "The speaker introduces himself and explains why outbound is essential for hitting quota."},
+  {"title": "Cold Email Strategy That Gets Replies", "start_time": 245, "summary": "How to write cold emails with high reply rates using buyer-centric messaging."}
 ]
 
 Guidelines:
@@ -404,10 +1360,7 @@ Guidelines:
 - Each chapter should represent a meaningful topic shift
 - Titles should be specific and descriptive, not generic like "Part 1"
 - start_time should be in seconds (integer)
-- Keep the title and summary in the same language as the video transcript
-
-## Transcript (with timestamps in [MM:SS] format):
-{transcript}"""
+- Keep the title and summary in the same language as the video transcript"""
 
 TOC_MODELS = [
     ("gemini", "gemini-2.5-flash"),
@@ -415,31 +1368,22 @@ TOC_MODELS = [
     ("anthropic", "claude-sonnet-4-20250514"),
 ]
 
+TOC_HEDGE = {"percentile": 90, "min_delay": 5.0, "max_delay": 60.0, "default_delay": 30.0}
 
-def generate_toc(transcript_with_timestamps: str) -> list[dict]:
-    """
-    用 AI 生成视频章节目录
+TOC_SCHEMA = json_array_schema({
+    "title": {"type": "string"},
+    "start_time": {"type": "integer"},
+    "summary": {"type": "string"},
+})
 
-    transcript_with_timestamps: 带时间戳的完整文本，格式如 "[0:00] text [0:30] text ..."
-    返回: [{"title", "title_zh", "start_time", "summary"}]
-    """
-    prompt = TOC_PROMPT.format(transcript=transcript_with_timestamps)
-    messages = [
-        {"role": "system", "content": "You are a content analyst that outputs only valid JSON."},
-        {"role": "user", "content": prompt},
-    ]
 
-    content, model = call_with_fallback(messages, TOC_MODELS, "ToC Generation")
+def _toc_messages(transcript_with_timestamps: str) -> list[dict]:
+    prefix = TOC_PREFIX.format(transcript=transcript_with_timestamps)
+    return prefixed_messages(JSON_SYSTEM, prefix, TOC_PROMPT)
 
-    # 解析 JSON — 处理可能的 markdown 代码块包裹
-    content = content.strip()
-    if content.startswith("```"):
-        # 去掉 ```json ... ```
-        content = re.sub(r'^```\w*\n?', '', content)
-        content = re.sub(r'\n?```$', '', content)
-        content = content.strip()
 
-    chapters = json.loads(content)
+def _parse_toc(content: str) -> list[dict]:
+    chapters = parse_json_array(content, "ToC")
 
     # 确保 start_time 是整数
     for ch in chapters:
@@ -448,11 +1392,25 @@ def generate_toc(transcript_with_timestamps: str) -> list[dict]:
     return chapters
 
 
+async def agenerate_toc(transcript_with_timestamps: str) -> list[dict]:
+    """
+    用 AI 生成视频章节目录
+
+    transcript_with_timestamps: 带时间戳的完整文本，格式如 "[0:00] text [0:30] text ..."
+    返回: [{"title", "title_zh", "start_time", "summary"}]
+    """
+    messages = _toc_messages(transcript_with_timestamps)
+    result, model = await acall_cached(
+        messages, TOC_MODELS, "ToC Generation", parse=_parse_toc, hedge=TOC_HEDGE, schema=TOC_SCHEMA,
+    )
+    return result
+
+
 # --------------- Context Notes 生成 ---------------
 
 CONTEXT_NOTES_PROMPT = """You are a cultural and language context analyst helping Chinese-speaking learners understand video content at a deeper level.
 
-Given a video transcript with numbered segments, identify moments where non-native speakers would benefit from additional context. Look for:
+Given the video transcript with numbered segments above, identify moments where non-native speakers would benefit from additional context. Look for:
 
 1. **Cultural References**: Idioms, slang, cultural assumptions, humor, sarcasm, pop-culture references
 2. **Knowledge Background**: Industry jargon, frameworks, referenced people/books/concepts, unstated assumptions the speaker expects the audience to know
@@ -467,20 +1425,17 @@ For each segment that needs a note, provide:
 
 Return ONLY a valid JSON array, no other text:
 [
-  {{"segment_index": 3, "type": "cultural", "title": "Chomping at the bit", "note": "这是一个英语习语，原意是马急着咬嚼子想跑，引申为'迫不及待'。"}},
-  {{"segment_index": 7, "type": "knowledge", "title": "SPIN Selling", "note": "SPIN Selling 是 Neil Rackham 提出的咨询式销售框架，通过提问发现客户需求。"}},
-  {{"segment_index": 12, "type": "social_connotation", "title": "Sarcastic 'Great job'", "note": "说话人语气带有讽刺，实际意思是做得很差。注意语调和上下文。"}},
-  {{"segment_index": 15, "type": "dialect_warning", "title": "Reckon (UK)", "note": "'reckon' 在英式英语中很常见，意为'认为/觉得'，但在美式英语中较少使用。"}}
+  {"segment_index": 3, "type": "cultural", "title": "Chomping at the bit", "note": "这是一个英语习语，原意是马急着咬嚼子想跑，引申为'迫不及待'。"},
+  {"segment_index": 7, "type": "knowledge", "title": "SPIN Selling", "note": "SPIN Selling 是 Neil Rackham 提出的咨询式销售框架，通过提问发现客户需求。"},
+  {"segment_index": 12, "type": "social_connotation", "title": "Sarcastic 'Great job'", "note": "说话人语气带有讽刺，实际意思是做得很差。注意语调和上下文。"},
+  {"segment_index": 15, "type": "dialect_warning", "title": "Reckon (UK)", "note": "'reckon' 在英式英语中很常见，意为'认为/觉得'，但在美式英语中较少使用。"}
 ]
 
 Guidelines:
 - Focus on things a Chinese native speaker would likely miss or misunderstand
 - Don't annotate simple vocabulary — focus on cultural context and background knowledge
 - Aim for 8-15 notes per 10-minute video (be selective, not exhaustive)
-- Keep notes concise and actionable
-
-## Transcript (numbered segments):
-{transcript_with_indices}"""
+- Keep notes concise and actionable"""
 
 CONTEXT_NOTES_MODELS = [
     ("gemini", "gemini-2.5-flash"),
@@ -488,71 +1443,51 @@ CONTEXT_NOTES_MODELS = [
     ("anthropic", "claude-sonnet-4-20250514"),
 ]
 
+CONTEXT_NOTES_HEDGE = {"percentile": 90, "min_delay": 5.0, "max_delay": 60.0, "default_delay": 30.0}
+
+CONTEXT_NOTES_SCHEMA = json_array_schema({
+    "segment_index": {"type": "integer"},
+    "type": {"type": "string", "enum": ["cultural", "knowledge", "social_connotation", "dialect_warning"]},
+    "title": {"type": "string"},
+    "note": {"type": "string"},
+})
+
+# 注释很稀疏（约 10 分钟 8-15 条），输出远小于输入
+CONTEXT_NOTES_CHUNK_BUDGET = {"output_per_input": 0.4, "max_input_tokens": 8000, "prompt_tokens": 1000}
+
 
-def generate_context_notes(transcript_with_indices: str) -> list[dict]:
+def _context_notes_messages(transcript_with_indices: str) -> list[dict]:
+    prefix = INDEXED_TRANSCRIPT_PREFIX.format(transcript_with_indices=transcript_with_indices)
+    return prefixed_messages(JSON_SYSTEM, prefix, CONTEXT_NOTES_PROMPT)
+
+
+def _parse_context_notes(content: str) -> list[dict]:
+    return _valid_items(parse_json_array(content, "Context notes"))
+
+
+async def agenerate_context_notes(
+    transcript_with_indices: str,
+    on_item: Callable[[dict], None] | None = None,
+) -> list[dict]:
     """
     用 AI 生成上下文注释
 
     transcript_with_indices: 带序号的文本，格式如 "[0] text\n[1] text\n..."
+    on_item: 可选回调，流式生成，每条注释的 JSON 对象一完整就回调一次（流式模式下不对冲）
+    输出被截断时保留完整的注释，只对尚未覆盖的 segment 续写
     返回: [{"segment_index", "type", "title", "note"}]
     """
-    prompt = CONTEXT_NOTES_PROMPT.format(transcript_with_indices=transcript_with_indices)
-    messages = [
-        {"role": "system", "content": "You are a context analyst. Output only valid JSON."},
-        {"role": "user", "content": prompt},
-    ]
-
-    content, model = call_with_fallback(messages, CONTEXT_NOTES_MODELS, "Context Notes")
-
-    # 解析 JSON
-    content = content.strip()
-    if content.startswith("```"):
-        content = re.sub(r'^```\w*\n?', '', content)
-        content = re.sub(r'\n?```$', '', content)
-        content = content.strip()
-
-    try:
-        notes = json.loads(content)
-    except json.JSONDecodeError as e:
-        print(f"Context notes JSON parsing failed: {str(e)[:100]}, attempting repair...")
-        notes = None
-
-        # 策略 1: 截断到最后一个完整对象 }
-        last_brace = content.rfind('}')
-        if last_brace > 0:
-            candidate = content[:last_brace+1].rstrip().rstrip(',') + ']'
-            arr_start = candidate.find('[')
-            if arr_start >= 0:
-                candidate = candidate[arr_start:]
-            try:
-                notes = json.loads(candidate)
-                print(f"Context notes JSON repaired, got {len(notes)} notes")
-            except json.JSONDecodeError:
-                pass
-
-        # 策略 2: 尾部括号修复
-        if notes is None:
-            fixed = content.rstrip().rstrip(',')
-            if not fixed.endswith(']'):
-                fixed += ']'
-            try:
-                notes = json.loads(fixed)
-                print(f"Context notes JSON repaired (bracket fix), got {len(notes)} notes")
-            except json.JSONDecodeError:
-                raise ValueError(f"Cannot repair context notes JSON: {str(e)[:200]}")
-
-    # 确保 segment_index 是整数
-    for note in notes:
-        note["segment_index"] = int(note.get("segment_index", 0))
-
-    return notes
+    return await _agenerate_items(
+        transcript_with_indices, _context_notes_messages, CONTEXT_NOTES_MODELS, "Context Notes",
+        _parse_context_notes, "title", on_item, CONTEXT_NOTES_HEDGE, schema=CONTEXT_NOTES_SCHEMA,
+    )
 
 
 # --------------- AI 词汇高亮 ---------------
 
 HIGHLIGHTS_PROMPT = """You are an expert language coach specializing in register-aware expression detection for Chinese-speaking professionals learning from authentic video content.
 
-Your job: Identify expressions in the transcript that are valuable for learners, and classify each by its REGISTER (how/where it's used), not just its form.
+Your job: Identify expressions in the transcript above that are valuable for learners, and classify each by its REGISTER (how/where it's used), not just its form.
 
 ## Register Tag System (4 tags)
 
@@ -583,9 +1518,9 @@ For each expression, provide:
 
 Return ONLY a valid JSON array:
 [
-  {{"segment_index": 2, "phrase": "aligned with", "register": "professional_spoken", "level": "B2", "frequency": "high", "translation": "与...一致/保持同步。比 agree with 更职业化，常用于会议和邮件", "alternative": "agree with"}},
-  {{"segment_index": 5, "phrase": "circle back", "register": "professional_spoken", "level": "B2", "frequency": "high", "translation": "稍后再讨论/回头再说。职场高频用语，尤其在会议中暂时搁置话题时", "alternative": "discuss later"}},
-  {{"segment_index": 8, "phrase": "utilize", "register": "formal_written", "level": "B2", "frequency": "low", "translation": "使用。过于正式，口语中直接说 use 更自然", "alternative": "use"}}
+  {"segment_index": 2, "phrase": "aligned with", "register": "professional_spoken", "level": "B2", "frequency": "high", "translation": "与...一致/保持同步。比 agree with 更职业化，常用于会议和邮件", "alternative": "agree with"},
+  {"segment_index": 5, "phrase": "circle back", "register": "professional_spoken", "level": "B2", "frequency": "high", "translation": "稍后再讨论/回头再说。职场高频用语，尤其在会议中暂时搁置话题时", "alternative": "discuss later"},
+  {"segment_index": 8, "phrase": "utilize", "register": "formal_written", "level": "B2", "frequency": "low", "translation": "使用。过于正式，口语中直接说 use 更自然", "alternative": "use"}
 ]
 
 CRITICAL JSON FORMATTING RULES:
@@ -603,10 +1538,7 @@ Guidelines:
 - Phrasal verbs are especially valuable — even advanced learners underuse them.
 - For formal_written register, emphasize that the expression is NOT recommended for speaking.
 - For regional_cultural register, ALWAYS explain which region in the translation.
-- Frequency should reflect how often native speakers use this in SPOKEN contexts (not written).
-
-## Transcript (numbered segments):
-{transcript_with_indices}"""
+- Frequency should reflect how often native speakers use this in SPOKEN contexts (not written)."""
 
 HIGHLIGHTS_MODELS = [
     ("gemini", "gemini-2.5-flash"),
@@ -614,66 +1546,47 @@ HIGHLIGHTS_MODELS = [
     ("anthropic", "claude-sonnet-4-20250514"),
 ]
 
+HIGHLIGHTS_HEDGE = {"percentile": 90, "min_delay": 5.0, "max_delay": 60.0, "default_delay": 30.0}
+
+HIGHLIGHTS_SCHEMA = json_array_schema({
+    "segment_index": {"type": "integer"},
+    "phrase": {"type": "string"},
+    "register": {
+        "type": "string",
+        "enum": ["general_spoken", "professional_spoken", "regional_cultural", "formal_written"],
+    },
+    "level": {"type": "string", "enum": ["A2", "B1", "B2", "C1"]},
+    "frequency": {"type": "string", "enum": ["very_high", "high", "medium", "low"]},
+    "translation": {"type": "string"},
+    "alternative": {"type": ["string", "null"]},
+})
+
+# 高亮不限数量，每条 JSON 对象约 70 token，密集段落的输出可达输入的数倍
+HIGHLIGHTS_CHUNK_BUDGET = {"output_per_input": 3.0, "max_input_tokens": 4000, "prompt_tokens": 1500}
+
 
-def generate_highlights(transcript_with_indices: str) -> list[dict]:
+def _highlights_messages(transcript_with_indices: str) -> list[dict]:
+    prefix = INDEXED_TRANSCRIPT_PREFIX.format(transcript_with_indices=transcript_with_indices)
+    return prefixed_messages(JSON_SYSTEM, prefix, HIGHLIGHTS_PROMPT)
+
+
+def _parse_highlights(content: str) -> list[dict]:
+    return _valid_items(parse_json_array(content, "Highlights"))
+
+
+async def agenerate_highlights(
+    transcript_with_indices: str,
+    on_item: Callable[[dict], None] | None = None,
+) -> list[dict]:
     """
     用 AI 生成词汇高亮
 
     transcript_with_indices: 带序号的文本，格式如 "[0] text\n[1] text\n..."
+    on_item: 可选回调，流式生成，每条高亮的 JSON 对象一完整就回调一次（流式模式下不对冲）
+    输出被截断时保留完整的高亮，只对尚未覆盖的 segment 续写
     返回: [{"segment_index", "phrase", "category", "translation", "level", "alternative"}]
     """
-    prompt = HIGHLIGHTS_PROMPT.format(transcript_with_indices=transcript_with_indices)
-    messages = [
-        {"role": "system", "content": "You are a vocabulary analyst for language learners. Output only valid JSON."},
-        {"role": "user", "content": prompt},
-    ]
-
-    content, model = call_with_fallback(messages, HIGHLIGHTS_MODELS, "AI Highlights")
-
-    # 解析 JSON
-    content = content.strip()
-    if content.startswith("```"):
-        content = re.sub(r'^```\w*\n?', '', content)
-        content = re.sub(r'\n?```$', '', content)
-        content = content.strip()
-
-    # 尝试解析 JSON，失败则尝试修复
-    try:
-        highlights = json.loads(content)
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing failed: {str(e)[:100]}, attempting repair...")
-        highlights = None
-
-        # 策略 1: 找到最后一个完整对象 }，截断并补 ]
-        last_brace = content.rfind('}')
-        if last_brace > 0:
-            candidate = content[:last_brace+1].rstrip().rstrip(',') + ']'
-            arr_start = candidate.find('[')
-            if arr_start >= 0:
-                candidate = candidate[arr_start:]
-            try:
-                highlights = json.loads(candidate)
-                print(f"JSON repaired (truncate to last complete object), got {len(highlights)} highlights")
-            except json.JSONDecodeError:
-                pass
-
-        # 策略 2: 去掉尾逗号 + 找最后的 ]
-        if highlights is None:
-            fixed = content.rstrip().rstrip(',')
-            last_bracket = fixed.rfind(']')
-            if last_bracket > 0:
-                fixed = fixed[:last_bracket+1]
-            try:
-                highlights = json.loads(fixed)
-                print(f"JSON repaired (trailing bracket), got {len(highlights)} highlights")
-            except json.JSONDecodeError:
-                pass
-
-        if highlights is None:
-            raise ValueError(f"JSON repair failed for highlights: {str(e)[:100]}")
-
-    # 确保 segment_index 是整数
-    for h in highlights:
-        h["segment_index"] = int(h.get("segment_index", 0))
-
-    return highlights
+    return await _agenerate_items(
+        transcript_with_indices, _highlights_messages, HIGHLIGHTS_MODELS, "AI Highlights",
+        _parse_highlights, "phrase", on_item, HIGHLIGHTS_HEDGE, schema=HIGHLIGHTS_SCHEMA,
+    )
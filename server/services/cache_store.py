@@ -1,32 +1,162 @@
 """
 SQLite 缓存层 — 按 video_id 分模块缓存 AI 结果
 后期可迁移 Supabase，只需替换此文件实现
+
+每个线程复用一个长连接（PRAGMA 只在建连时执行一次），sqlite3 自带的语句缓存
+让重复的 SQL 只编译一次；批量读写用 get_many / set_many，一次查询取回多个模块。
+async 代码用 a* 版本（aget_cache / aset_cache ...），不在事件循环里做 SQLite I/O。
+video_cache 前面还有一层按字节限额的内存 LRU，热门视频的结果不用再读盘和 json.loads。
+后台线程定期维护 video_cache：按模块 TTL 过期、超出总量按最久未访问淘汰、
+清理已被合并结果取代的 chunk 条目，并增量回收空闲页（maintain_cache）。
+video_cache 的值以 zlib 压缩的 BLOB 存储（带预置字典，见 _ZDICTS），size 列为压缩后字节数。
 """
 
+import os
 import json
+import time
+import asyncio
 import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 DB_PATH = Path(__file__).parent.parent / "data" / "app.db"
 
+# LLM 响应缓存的总大小上限（MB），超出后按最近访问时间淘汰；设为 0 关闭缓存
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024)
 
-def _get_conn() -> sqlite3.Connection:
+# video_cache 内存层上限（MB，按 JSON 的 UTF-8 字节数计），设为 0 关闭
+MEMORY_CACHE_MAX_BYTES = int(float(os.getenv("VIDEO_CACHE_MEMORY_MB", "64")) * 1024 * 1024)
+
+# video_cache 磁盘总量上限（MB，按压缩后大小计），维护时超出部分按最久未访问淘汰
+VIDEO_CACHE_MAX_BYTES = int(float(os.getenv("VIDEO_CACHE_MAX_MB", "500")) * 1024 * 1024)
+
+# 各模块多少天没被访问就删除，None 为永不过期；以 _ 或 : 结尾的键按前缀匹配，最长匹配优先
+# （依赖段落切分的模块名带 SEGMENTATION_TAG 后缀，如 "highlights:v2:3"）
+VIDEO_CACHE_TTL_DAYS: dict[str, float | None] = {
+    "chapters": 90,
+    "context_notes:": 90,
+    "highlights:": 90,
+    "highlights_ch_": 7,      # 单 chunk 结果只为失败后续跑服务
+    "transcript:": 30,
+    "transcript_meta:": 30,
+    "transcript_merged:": 30,
+}
+DEFAULT_TTL_DAYS = 30
+
+# 写入以左边为前缀的模块后，同一视频下以右边为前缀的模块已被取代，直接删除
+SUPERSEDED_MODULES = {
+    "highlights:": "highlights_ch_",
+}
+
+# 后台维护间隔（秒）
+CACHE_MAINTENANCE_INTERVAL = 600.0
+
+# video_cache 值的 zlib 压缩级别
+COMPRESS_LEVEL = 6
+# 启动时把旧库的 TEXT 行压缩成 BLOB，每个事务处理的行数
+MIGRATE_BATCH_ROWS = 200
+
+# 每个连接缓存的预编译语句数
+STATEMENT_CACHE_SIZE = 128
+# IN (...) 一次最多绑定的参数个数（SQLite 旧版本上限 999）
+MAX_BATCH_PARAMS = 500
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = sqlite3.connect(str(DB_PATH), cached_statements=STATEMENT_CACHE_SIZE)
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    conn.create_function("module_ttl", 1, module_ttl_days, deterministic=True)
     return conn
 
 
+def module_ttl_days(module: str) -> float | None:
+    """模块的 TTL（天），见 VIDEO_CACHE_TTL_DAYS"""
+    ttl = VIDEO_CACHE_TTL_DAYS.get(module, DEFAULT_TTL_DAYS)
+    best = 0
+    for key, days in VIDEO_CACHE_TTL_DAYS.items():
+        if key[-1] in "_:" and module.startswith(key) and len(key) > best:
+            ttl, best = days, len(key)
+    return ttl
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _get_conn() -> sqlite3.Connection:
+    """当前线程的长连接（sqlite3 连接不能跨线程使用），线程结束时随之释放"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+
+def _batches(items: list, size: int = MAX_BATCH_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# --------------- 压缩编码 ---------------
+# BLOB 格式：1 字节字典版本 + zlib 流。预置字典（zlib 的 zdict）是手工整理的、缓存结果里
+# 反复出现的键和取值片段，不是从样本训练出来的；短结果也能压到很小。越常见的片段放得越靠后。
+# 修改字典时新增一个版本，旧版本保留用于解码
+
+_ZDICTS = {
+    1: "".join([
+        '{"hash": "", "source_hash": "", "segments": [',
+        '{"title": "", "start_time": , "segmentRange": [, ]}, ',
+        '{"notes": [{"segment_index": , "type": "cultural", "type": "knowledge", ',
+        '"type": "social_connotation", "type": "dialect_warning", "title": "", "note": ""}, ',
+        '], "total": }',
+        '{"highlights": {"": [{"phrase": "", "start": , "end": , "translation": "", ',
+        '"alternative": null, "frequency": "low", "frequency": "medium", "frequency": "high", ',
+        '"level": "A2", "level": "B1", "level": "C1", "level": "B2", ',
+        '"register": "regional_cultural", "color": "yellow", "register": "formal_written", "color": "gray", ',
+        '"register": "general_spoken", "color": "green", "register": "professional_spoken", "color": "blue", ',
+        '"alternative": "", "translation": "', '。', '", "level": "B2", "frequency": "medium", ',
+        '{"text": "", "start": , "duration": }, {"text": "',
+    ]).encode("utf-8"),
+}
+ZDICT_VERSION = max(_ZDICTS)
+
+
+def _encode(raw: bytes) -> bytes:
+    """JSON 文本（UTF-8 bytes）→ 压缩 BLOB"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=_ZDICTS[ZDICT_VERSION])
+    return bytes([ZDICT_VERSION]) + compressor.compress(raw) + compressor.flush()
+
+
+def _decode(blob: bytes | str) -> bytes:
+    """压缩 BLOB → JSON 文本（UTF-8 bytes，json.loads 可直接解析）；兼容未迁移的 TEXT 行"""
+    if isinstance(blob, str):
+        return blob.encode("utf-8")
+    decompressor = zlib.decompressobj(zdict=_ZDICTS[blob[0]])
+    return decompressor.decompress(blob[1:]) + decompressor.flush()
+
+
 def _init_db():
-    conn = _get_conn()
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(DB_PATH))
+    # 新库直接启用增量 vacuum：必须在建表和切换 WAL 之前设置，否则不生效
+    # （旧库的一次性转换见 _ensure_incremental_vacuum）
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS video_cache (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             video_id TEXT NOT NULL,
             module TEXT NOT NULL,
-            data TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_access TIMESTAMP,
             UNIQUE(video_id, module)
         );
 
@@ -43,46 +173,286 @@ def _init_db():
             segment_start REAL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
+
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            content TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_access TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access);
     """)
+    _migrate_video_cache(conn)
     conn.close()
 
 
+def _migrate_video_cache(conn: sqlite3.Connection):
+    """
+    旧库补上 size / last_access 列和索引，未压缩的 TEXT 行压缩成 BLOB
+    （腾出的空间由 maintain_cache 回收）
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(video_cache)")}
+    with conn:
+        if "size" not in columns:
+            conn.execute("ALTER TABLE video_cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE video_cache SET size = length(CAST(data AS BLOB))")
+        if "last_access" not in columns:
+            conn.execute("ALTER TABLE video_cache ADD COLUMN last_access TIMESTAMP")
+            conn.execute("UPDATE video_cache SET last_access = created_at")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_video_cache_last_access ON video_cache(last_access)")
+
+    compressed = 0
+    while True:
+        with conn:
+            rows = conn.execute(
+                "SELECT id, data FROM video_cache WHERE typeof(data) = 'text' LIMIT ?",
+                (MIGRATE_BATCH_ROWS,),
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for row_id, raw in rows:
+                blob = _encode(raw.encode("utf-8"))
+                updates.append((blob, len(blob), row_id))
+            conn.executemany("UPDATE video_cache SET data = ?, size = ? WHERE id = ?", updates)
+        compressed += len(rows)
+    if compressed:
+        print(f"Compressed {compressed} video_cache rows")
+
+
 # 初始化数据库
 _init_db()
 
 
+# --------------- 内存 LRU（video_cache 前置层） ---------------
+# 存解码后的对象，按解压后 JSON 的 UTF-8 字节数计入总量；写入时同时更新（write-through），clear_cache 时失效。
+# 命中返回的对象与缓存共享，调用方不要原地修改
+# 读者 SELECT 期间可能有写入 / 失效插进来，读到的旧值不能再回填：每次写入和失效给该键分配新的代数，
+# 读者在 SELECT 前记下代数，回填时代数变了就放弃（_memory_generations / _memory_put 的 generation 参数）
+
+_memory_lock = threading.Lock()
+_memory: OrderedDict[tuple[str, str], tuple[object, int]] = OrderedDict()
+_memory_bytes = 0
+_memory_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# (video_id, module) -> 最近一次写入 / 失效的代数；(video_id, None) 为整个视频的失效。
+# 代数取自单调递增的 _memory_clock，维护时清空并把 _memory_gen_floor 抬到当前时钟
+_memory_gens: dict[tuple[str, str | None], int] = {}
+_memory_clock = 0
+_memory_gen_floor = 0
+# 读命中的 (video_id, module)，维护时批量写回 last_access，读路径不产生写操作
+_pending_access: set[tuple[str, str]] = set()
+
+
+def _record_access(video_id: str, module: str) -> None:
+    with _memory_lock:
+        _pending_access.add((video_id, module))
+
+
+def _memory_get(video_id: str, module: str):
+    key = (video_id, module)
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is None:
+            _memory_stats["misses"] += 1
+            return None
+        _memory.move_to_end(key)
+        _memory_stats["hits"] += 1
+        return entry[0]
+
+
+def _current_generation(video_id: str, module: str) -> int:
+    """调用方持有 _memory_lock"""
+    return max(
+        _memory_gens.get((video_id, module), _memory_gen_floor),
+        _memory_gens.get((video_id, None), _memory_gen_floor),
+    )
+
+
+def _bump_generation(key: tuple[str, str | None]) -> None:
+    """调用方持有 _memory_lock"""
+    global _memory_clock
+    _memory_clock += 1
+    _memory_gens[key] = _memory_clock
+
+
+def _memory_generations(video_id: str, modules: list[str]) -> dict[str, int]:
+    """读 SQLite 之前记下各模块的代数，回填内存层时传给 _memory_put"""
+    with _memory_lock:
+        return {module: _current_generation(video_id, module) for module in modules}
+
+
+def _memory_put(video_id: str, module: str, data, size: int, generation: int | None = None) -> None:
+    """
+    写入内存层。generation 为 None 表示写者（新值已提交到 SQLite），分配新代数；
+    读者回填时传入读之前的代数，期间有过写入或失效就放弃，不把旧值放回去
+    """
+    global _memory_bytes
+    key = (video_id, module)
+    with _memory_lock:
+        if generation is None:
+            _bump_generation(key)
+        elif generation != _current_generation(video_id, module):
+            return
+        old = _memory.pop(key, None)
+        if old is not None:
+            _memory_bytes -= old[1]
+        if size > MEMORY_CACHE_MAX_BYTES:
+            return
+        _memory[key] = (data, size)
+        _memory_bytes += size
+        while _memory_bytes > MEMORY_CACHE_MAX_BYTES:
+            _, (_, evicted_size) = _memory.popitem(last=False)
+            _memory_bytes -= evicted_size
+            _memory_stats["evictions"] += 1
+
+
+def _memory_invalidate(video_id: str, module: str | None = None) -> None:
+    global _memory_bytes
+    with _memory_lock:
+        _bump_generation((video_id, module))
+        keys = [(video_id, module)] if module else [key for key in _memory if key[0] == video_id]
+        for key in keys:
+            entry = _memory.pop(key, None)
+            if entry is not None:
+                _memory_bytes -= entry[1]
+
+
+def memory_cache_stats() -> dict:
+    """内存层的条目数、占用和命中统计，供 /api/metrics/cache 展示"""
+    with _memory_lock:
+        lookups = _memory_stats["hits"] + _memory_stats["misses"]
+        return {
+            "entries": len(_memory),
+            "bytes": _memory_bytes,
+            "max_bytes": MEMORY_CACHE_MAX_BYTES,
+            **_memory_stats,
+            "hit_rate": round(_memory_stats["hits"] / lookups, 3) if lookups else None,
+        }
+
+
+# --------------- video_cache ---------------
+
 def get_cache(video_id: str, module: str) -> dict | list | None:
     """获取缓存的 AI 结果，无缓存返回 None"""
+    data = _memory_get(video_id, module)
+    if data is None:
+        generation = _memory_generations(video_id, [module])[module]
+        conn = _get_conn()
+        with conn:
+            row = conn.execute(
+                "SELECT data FROM video_cache WHERE video_id = ? AND module = ?",
+                (video_id, module),
+            ).fetchone()
+        if row is None:
+            return None
+        raw = _decode(row[0])
+        data = json.loads(raw)
+        _memory_put(video_id, module, data, len(raw), generation)
+    _record_access(video_id, module)
+    return data
+
+
+def get_cache_with_age(video_id: str, module: str) -> tuple[dict | list, float] | None:
+    """获取缓存及其写入后经过的秒数，无缓存返回 None（需要写入时间，直接读 SQLite）"""
     conn = _get_conn()
-    try:
+    with conn:
         row = conn.execute(
-            "SELECT data FROM video_cache WHERE video_id = ? AND module = ?",
+            """SELECT data, (julianday('now') - julianday(created_at)) * 86400
+               FROM video_cache WHERE video_id = ? AND module = ?""",
             (video_id, module),
         ).fetchone()
-        if row:
-            return json.loads(row[0])
+    if row is None:
         return None
-    finally:
-        conn.close()
+    _record_access(video_id, module)
+    return json.loads(_decode(row[0])), row[1]
+
+
+def touch_cache(video_id: str, module: str) -> None:
+    """内容没变时只刷新写入时间，重新开始计算 TTL"""
+    conn = _get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE video_cache SET created_at = CURRENT_TIMESTAMP WHERE video_id = ? AND module = ?",
+            (video_id, module),
+        )
 
 
 def set_cache(video_id: str, module: str, data) -> None:
     """存储 AI 结果到缓存"""
+    _store(video_id, {module: json.dumps(data, ensure_ascii=False).encode("utf-8")})
+
+
+def _store(video_id: str, raws: dict[str, bytes]) -> None:
+    """写入若干模块的 JSON 文本（UTF-8 bytes），顺带删除被它们取代的模块（SUPERSEDED_MODULES）"""
+    blobs = {module: _encode(raw) for module, raw in raws.items()}
     conn = _get_conn()
-    try:
-        conn.execute(
-            "INSERT OR REPLACE INTO video_cache (video_id, module, data) VALUES (?, ?, ?)",
-            (video_id, module, json.dumps(data, ensure_ascii=False)),
+    with conn:
+        conn.executemany(
+            """INSERT OR REPLACE INTO video_cache (video_id, module, data, size, last_access)
+               VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+            [(video_id, module, blob, len(blob)) for module, blob in blobs.items()],
+        )
+        superseded = []
+        for key, prefix in SUPERSEDED_MODULES.items():
+            if not any(module.startswith(key) for module in raws):
+                continue
+            superseded += [row[0] for row in conn.execute(
+                "SELECT module FROM video_cache WHERE video_id = ? AND module LIKE ? ESCAPE '\\'",
+                (video_id, _like_prefix(prefix)),
+            )]
+        conn.executemany(
+            "DELETE FROM video_cache WHERE video_id = ? AND module = ?",
+            [(video_id, module) for module in superseded],
         )
-        conn.commit()
-    finally:
-        conn.close()
+    # 内存层存一份重新解码的对象，调用方之后修改 data 不会影响缓存
+    for module, raw in raws.items():
+        _memory_put(video_id, module, json.loads(raw), len(raw))
+    for module in superseded:
+        _memory_invalidate(video_id, module)
+
+
+def get_many(video_id: str, modules: list[str]) -> dict[str, dict | list]:
+    """批量获取同一视频的多个模块，返回 {module: data}，未命中的模块不在结果里"""
+    result = {}
+    missing = []
+    for module in dict.fromkeys(modules):
+        data = _memory_get(video_id, module)
+        if data is not None:
+            result[module] = data
+        else:
+            missing.append(module)
+    generations = _memory_generations(video_id, missing)
+    conn = _get_conn()
+    with conn:
+        for batch in _batches(missing):
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT module, data FROM video_cache WHERE video_id = ? AND module IN ({placeholders})",
+                (video_id, *batch),
+            ).fetchall()
+            for module, blob in rows:
+                raw = _decode(blob)
+                result[module] = json.loads(raw)
+                _memory_put(video_id, module, result[module], len(raw), generations[module])
+    for module in result:
+        _record_access(video_id, module)
+    return result
+
+
+def set_many(video_id: str, items: dict[str, object]) -> None:
+    """批量写入同一视频的多个模块（一个事务）"""
+    if items:
+        _store(video_id, {
+            module: json.dumps(data, ensure_ascii=False).encode("utf-8") for module, data in items.items()
+        })
 
 
 def clear_cache(video_id: str, module: str = None) -> int:
     """清除缓存，返回删除的行数"""
     conn = _get_conn()
-    try:
+    with conn:
         if module:
             cursor = conn.execute(
                 "DELETE FROM video_cache WHERE video_id = ? AND module = ?",
@@ -93,10 +463,221 @@ def clear_cache(video_id: str, module: str = None) -> int:
                 "DELETE FROM video_cache WHERE video_id = ?",
                 (video_id,),
             )
-        conn.commit()
-        return cursor.rowcount
-    finally:
-        conn.close()
+    _memory_invalidate(video_id, module)
+    return cursor.rowcount
+
+
+# --------------- 异步接口 ---------------
+# 写操作交给一个专用线程串行执行：SQLite 同一时间只有一个写者，串行化后不会互相等写锁，
+# 大结果的 json.dumps 也不占事件循环；读操作放到默认线程池并发执行（WAL 下读写互不阻塞）
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+
+async def _write(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_writer, fn, *args)
+
+
+async def aget_cache(video_id: str, module: str) -> dict | list | None:
+    return await asyncio.to_thread(get_cache, video_id, module)
+
+
+async def aget_many(video_id: str, modules: list[str]) -> dict[str, dict | list]:
+    return await asyncio.to_thread(get_many, video_id, modules)
+
+
+async def aset_cache(video_id: str, module: str, data) -> None:
+    await _write(set_cache, video_id, module, data)
+
+
+async def aset_many(video_id: str, items: dict[str, object]) -> None:
+    await _write(set_many, video_id, items)
+
+
+async def aget_llm_cache(key: str) -> tuple[str, str] | None:
+    return await asyncio.to_thread(get_llm_cache, key)
+
+
+async def aset_llm_cache(key: str, content: str, model: str) -> None:
+    await _write(set_llm_cache, key, content, model)
+
+
+async def asave_expression(data: dict) -> int:
+    return await _write(save_expression, data)
+
+
+async def aget_saved_expressions() -> list[dict]:
+    return await asyncio.to_thread(get_saved_expressions)
+
+
+async def adelete_expression(expr_id: int) -> bool:
+    return await _write(delete_expression, expr_id)
+
+
+# --------------- video_cache 维护 ---------------
+
+_maintenance_lock = threading.Lock()
+_maintenance: threading.Thread | None = None
+
+
+def maintain_cache() -> dict:
+    """
+    video_cache 维护：写回读命中的访问时间（连同 llm_cache 的），删除超过模块 TTL 的条目和已被合并结果取代的条目，
+    总量超过 VIDEO_CACHE_MAX_BYTES 时按最久未访问淘汰，最后增量回收空闲页。返回各项条数
+    """
+    global _memory_gen_floor
+    with _memory_lock:
+        accessed = list(_pending_access)
+        _pending_access.clear()
+        # 代数表只需覆盖进行中的读；清空后所有键的代数都抬到当前时钟，进行中的回填最多放弃一次
+        _memory_gens.clear()
+        _memory_gen_floor = _memory_clock
+
+    conn = _get_conn()
+    with conn:
+        conn.executemany(
+            "UPDATE video_cache SET last_access = CURRENT_TIMESTAMP WHERE video_id = ? AND module = ?",
+            accessed,
+        )
+        _flush_llm_access(conn)
+        expired = conn.execute(
+            """SELECT video_id, module FROM video_cache
+               WHERE module_ttl(module) IS NOT NULL
+                 AND julianday('now') - julianday(COALESCE(last_access, created_at)) > module_ttl(module)"""
+        ).fetchall()
+        superseded = []
+        for key, prefix in SUPERSEDED_MODULES.items():
+            superseded += conn.execute(
+                """SELECT video_id, module FROM video_cache
+                   WHERE module LIKE ? ESCAPE '\\'
+                     AND video_id IN (SELECT video_id FROM video_cache WHERE module LIKE ? ESCAPE '\\')""",
+                (_like_prefix(prefix), _like_prefix(key)),
+            ).fetchall()
+        removed = set(expired) | set(superseded)
+        conn.executemany("DELETE FROM video_cache WHERE video_id = ? AND module = ?", removed)
+
+        evicted = []
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM video_cache").fetchone()[0]
+        if total > VIDEO_CACHE_MAX_BYTES:
+            excess = total - VIDEO_CACHE_MAX_BYTES
+            for video_id, module, size in conn.execute(
+                "SELECT video_id, module, size FROM video_cache ORDER BY last_access, created_at"
+            ).fetchall():
+                evicted.append((video_id, module))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM video_cache WHERE video_id = ? AND module = ?", evicted)
+
+    for video_id, module in removed.union(evicted):
+        _memory_invalidate(video_id, module)
+
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if _ensure_incremental_vacuum(conn):
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+
+    stats = {
+        "expired": len(expired),
+        "superseded": len(superseded),
+        "evicted": len(evicted),
+        "freed_pages": free_pages,
+    }
+    if any(stats.values()):
+        print(f"Cache maintenance: {stats}")
+    return stats
+
+
+def _ensure_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    旧库（auto_vacuum 不是 INCREMENTAL）做一次全量 VACUUM 完成转换，同时回收全部空闲页。
+    返回 True 表示库已是增量模式，调用方再做 incremental_vacuum
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return True
+    print("Converting app.db to incremental auto-vacuum...")
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return False
+
+
+def _maintenance_loop():
+    # 启动后先跑一次（旧库的 vacuum 转换在这里完成，不占用 import），之后按间隔执行
+    while True:
+        try:
+            # 和其他写操作一样在写线程上串行执行
+            _writer.submit(maintain_cache).result()
+        except Exception as e:
+            print(f"Cache maintenance failed: {e}")
+        time.sleep(CACHE_MAINTENANCE_INTERVAL)
+
+
+def start_cache_maintenance():
+    """启动后台维护线程（每个进程一个，重复调用无副作用）"""
+    global _maintenance
+    with _maintenance_lock:
+        if _maintenance is None:
+            _maintenance = threading.Thread(target=_maintenance_loop, name="cache-maintenance", daemon=True)
+            _maintenance.start()
+
+
+# --------------- LLM 响应缓存（按 prompt 内容寻址） ---------------
+# 命中只记下 key，访问时间由写线程批量写回（set_llm_cache 淘汰前、maintain_cache），读路径不写库
+
+_llm_access_lock = threading.Lock()
+_pending_llm_access: set[str] = set()
+
+
+def _flush_llm_access(conn: sqlite3.Connection) -> None:
+    """把读命中的 last_access 写回 llm_cache，在调用方的事务里执行"""
+    with _llm_access_lock:
+        accessed = [(key,) for key in _pending_llm_access]
+        _pending_llm_access.clear()
+    conn.executemany("UPDATE llm_cache SET last_access = CURRENT_TIMESTAMP WHERE key = ?", accessed)
+
+
+def get_llm_cache(key: str) -> tuple[str, str] | None:
+    """按内容哈希取缓存的模型输出，返回 (content, "provider/model")，无缓存返回 None"""
+    if LLM_CACHE_MAX_BYTES <= 0:
+        return None
+    conn = _get_conn()
+    with conn:
+        row = conn.execute(
+            "SELECT content, model FROM llm_cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+    if row is None:
+        return None
+    with _llm_access_lock:
+        _pending_llm_access.add(key)
+    return row[0], row[1]
+
+
+def set_llm_cache(key: str, content: str, model: str) -> None:
+    """写入模型输出缓存，总大小超过 LLM_CACHE_MAX_BYTES 时淘汰最久未访问的条目"""
+    if LLM_CACHE_MAX_BYTES <= 0:
+        return
+    size = len(content.encode("utf-8"))
+    conn = _get_conn()
+    with conn:
+        # 先写回访问时间，淘汰顺序才反映最近的命中
+        _flush_llm_access(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, model, content, size) VALUES (?, ?, ?, ?)",
+            (key, model, content, size),
+        )
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > LLM_CACHE_MAX_BYTES:
+            excess = total - LLM_CACHE_MAX_BYTES
+            evict = []
+            for old_key, old_size in conn.execute(
+                "SELECT key, size FROM llm_cache WHERE key != ? ORDER BY last_access, created_at",
+                (key,),
+            ):
+                evict.append((old_key,))
+                excess -= old_size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM llm_cache WHERE key = ?", evict)
 
 
 # --------------- Saved Expressions (Deck) ---------------
@@ -104,7 +685,7 @@ def clear_cache(video_id: str, module: str = None) -> int:
 def save_expression(data: dict) -> int:
     """保存一个表达到词库，返回 id"""
     conn = _get_conn()
-    try:
+    with conn:
         cursor = conn.execute(
             """INSERT INTO saved_expressions
                (phrase, register, level, frequency, translation, alternative, context_sentence, video_id, segment_start)
@@ -121,33 +702,26 @@ def save_expression(data: dict) -> int:
                 data.get("segment_start"),
             ),
         )
-        conn.commit()
         return cursor.lastrowid
-    finally:
-        conn.close()
 
 
 def get_saved_expressions() -> list[dict]:
     """获取所有保存的表达，按时间倒序"""
     conn = _get_conn()
-    conn.row_factory = sqlite3.Row
-    try:
-        rows = conn.execute(
+    with conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        rows = cursor.execute(
             "SELECT * FROM saved_expressions ORDER BY created_at DESC"
         ).fetchall()
         return [dict(row) for row in rows]
-    finally:
-        conn.close()
 
 
 def delete_expression(expr_id: int) -> bool:
     """删除一个表达，返回是否成功"""
     conn = _get_conn()
-    try:
+    with conn:
         cursor = conn.execute(
             "DELETE FROM saved_expressions WHERE id = ?", (expr_id,)
         )
-        conn.commit()
         return cursor.rowcount > 0
-    finally:
-        conn.close()
@@ -0,0 +1,109 @@
+"""
+Chunk 规划 — 按估算 token 数而不是固定 segment 数把 transcript 切成 AI 调用的 chunk
+供 highlights / context notes 路由共用
+"""
+
+import math
+
+from server.services.ai_pipeline import estimate_tokens
+
+# 每行 "[123] " 序号前缀和换行的 token 开销
+LINE_OVERHEAD_TOKENS = 4
+
+
+def segment_tokens(seg: dict) -> int:
+    return estimate_tokens(seg.get("text", "")) + LINE_OVERHEAD_TOKENS
+
+
+def _split_balanced(tokens: list[int], max_tokens: int) -> list[int]:
+    """
+    把一段连续 segment 切成尽量均匀、每份不超过 max_tokens 的若干份，返回每份的长度。
+    先按总量算出最少份数，再按平均目标贪心切，避免最后剩一个很小的尾巴
+    """
+    total = sum(tokens)
+    parts = max(1, math.ceil(total / max_tokens))
+    target = total / parts
+
+    sizes = []
+    count = 0
+    acc = 0
+    consumed = 0
+    for t in tokens:
+        remaining_parts = parts - len(sizes)
+        over_target = acc + t > target and count > 0 and remaining_parts > 1
+        if count > 0 and (acc + t > max_tokens or over_target):
+            sizes.append(count)
+            consumed += acc
+            count, acc = 0, 0
+            # 重新按剩余量计算目标，保证后面的份数仍然均匀
+            remaining_parts = max(parts - len(sizes), 1)
+            target = (total - consumed) / remaining_parts
+        count += 1
+        acc += t
+    if count:
+        sizes.append(count)
+    return sizes
+
+
+def plan_chunks(
+    segments: list[dict],
+    max_tokens: int,
+    chapters: list[dict] | None = None,
+) -> list[tuple[int, list[dict], str]]:
+    """
+    规划 chunk：每个 chunk 的估算输入 token 不超过 max_tokens，且不跨越 chapter 边界
+
+    chapters: 可选 [{title, segmentRange: [start, end]}]，没有时整个 transcript 视为一个 chapter
+    返回: [(start_idx, chunk_segs, title), ...]；被拆分的 chapter 标题带 "(i/n)"
+    """
+    if not segments:
+        return []
+
+    if chapters:
+        ranges = []
+        for ch in chapters:
+            seg_range = ch.get("segmentRange", [0, len(segments) - 1])
+            ranges.append((seg_range[0], seg_range[1] + 1, ch.get("title", "")))
+    else:
+        ranges = [(0, len(segments), "")]
+
+    specs: list[tuple[int, list[dict], str]] = []
+    for start, end, title in ranges:
+        chunk_segs = segments[start:end]
+        if not chunk_segs:
+            continue
+        sizes = _split_balanced([segment_tokens(s) for s in chunk_segs], max_tokens)
+
+        offset = 0
+        for part_num, size in enumerate(sizes, 1):
+            sub_title = f"{title} ({part_num}/{len(sizes)})" if title and len(sizes) > 1 else title
+            specs.append((start + offset, chunk_segs[offset:offset + size], sub_title))
+            offset += size
+
+    return specs
+
+
+def take_complete_chunks(
+    segments: list[dict],
+    start_idx: int,
+    max_tokens: int,
+    final: bool = False,
+) -> list[tuple[int, list[dict]]]:
+    """
+    增量模式（直播）：从 start_idx 起切出已经"满"的 chunk —— 再加下一个 segment 就会超出 max_tokens。
+    未满的尾部留到下次；final=True 时尾部也作为一个 chunk 返回
+
+    返回: [(start_idx, chunk_segs), ...]，调用方把起点推进到最后一个 chunk 之后
+    """
+    chunks = []
+    chunk_start = start_idx
+    acc = 0
+    for idx in range(start_idx, len(segments)):
+        tokens = segment_tokens(segments[idx])
+        if idx > chunk_start and acc + tokens > max_tokens:
+            chunks.append((chunk_start, segments[chunk_start:idx]))
+            chunk_start, acc = idx, 0
+        acc += tokens
+    if final and chunk_start < len(segments):
+        chunks.append((chunk_start, segments[chunk_start:]))
+    return chunks
@@ -0,0 +1,177 @@
+"""
+词典快照 — 把 JSON 词典预编译成紧凑的二进制索引，启动时 mmap 加载
+
+快照包含匹配自动机的扁平表（见 PhraseMatcher.tables）和按词条下标存储的
+translation / level 列。文件以只读 mmap 打开，多个 uvicorn worker 共享同一份
+page cache，启动时不再解析 JSON 或构建自动机。
+
+源 JSON 内容的 hash 记录在快照头部，加载时不一致（或快照不存在、格式变化）
+就自动重建。也可以手动构建：
+
+    python -m server.services.dictionary_index
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from server.services.phrase_matcher import CompiledMatcher, PhraseMatcher, fold_case
+
+# 词典目录
+DICT_DIR = Path(__file__).parent.parent / "data" / "dictionaries"
+# 默认加载的基础词典
+DICT_FILES = ["common_phrases.json", "workplace_slang.json"]
+INDEX_PATH = Path(__file__).parent.parent / "data" / "dictionary.idx"
+
+INDEX_MAGIC = b"DICTIDX\x01"
+INDEX_FORMAT = 2
+_ALIGN = 8
+
+
+def load_dictionaries(strict: bool = False) -> list[dict]:
+    """加载所有 JSON 词典；strict 时解析失败直接抛出，而不是跳过该文件"""
+    phrases = []
+    for filename in DICT_FILES:
+        path = DICT_DIR / filename
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                phrases.extend(data)
+            except Exception as e:
+                if strict:
+                    raise
+                print(f"Error loading dictionary {filename}: {e}")
+    return phrases
+
+
+def source_hash() -> str:
+    """源 JSON 词典的内容 hash（文件名 + 内容）"""
+    digest = hashlib.sha256()
+    for filename in DICT_FILES:
+        path = DICT_DIR / filename
+        if path.exists():
+            digest.update(filename.encode("utf-8") + b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _string_column(values: list[str]) -> tuple[array, bytes]:
+    offsets = array("I", [0])
+    blob = bytearray()
+    for value in values:
+        blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def build_index(path: Path = INDEX_PATH, strict: bool = False) -> Path:
+    """编译 JSON 词典为快照文件（先写临时文件再原子替换，并发重建也安全）"""
+    digest = source_hash()
+    phrases = load_dictionaries(strict)
+    matcher = PhraseMatcher([fold_case(entry["phrase"]) for entry in phrases])
+
+    levels = sorted({entry.get("level", "B2") for entry in phrases})
+    level_codes = {level: code for code, level in enumerate(levels)}
+    translation_offsets, translation_blob = _string_column([entry.get("translation", "") for entry in phrases])
+
+    sections = dict(matcher.tables())
+    sections["level"] = array("B", [level_codes[entry.get("level", "B2")] for entry in phrases])
+    sections["translation_offsets"] = translation_offsets
+    sections["translation_blob"] = translation_blob
+
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else "B"
+        size = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        layout[name] = [offset, size, typecode]
+        offset += size + (-size % _ALIGN)
+
+    header = json.dumps({
+        "format": INDEX_FORMAT,
+        "byteorder": sys.byteorder,
+        "source_hash": digest,
+        "entries": len(phrases),
+        "levels": levels,
+        "sections": layout,
+    }).encode("utf-8")
+    prefix = INDEX_MAGIC + struct.pack("<I", len(header)) + header
+    prefix += b"\0" * (-len(prefix) % _ALIGN)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        for name, data in sections.items():
+            raw = data.tobytes() if isinstance(data, array) else data
+            f.write(raw)
+            f.write(b"\0" * (-len(raw) % _ALIGN))
+    os.replace(tmp_path, path)
+    print(f"Dictionary index built: {len(phrases)} entries, {len(sections['fail'])} nodes → {path}")
+    return path
+
+
+class DictionarySnapshot:
+    """只读 mmap 的词典快照：matcher 用于匹配，entry(idx) 取词条信息"""
+
+    def __init__(self, path: Path = INDEX_PATH):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        if bytes(view[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+            raise ValueError(f"{path}: not a dictionary index")
+        (header_len,) = struct.unpack_from("<I", view, len(INDEX_MAGIC))
+        header_start = len(INDEX_MAGIC) + 4
+        self.header = json.loads(bytes(view[header_start:header_start + header_len]))
+        base = header_start + header_len
+        base += -base % _ALIGN
+
+        self._sections = {}
+        for name, (offset, size, typecode) in self.header["sections"].items():
+            self._sections[name] = view[base + offset:base + offset + size].cast(typecode)
+
+        self.source_hash: str = self.header["source_hash"]
+        self.version: str = self.source_hash[:12]
+        self._levels: list[str] = self.header["levels"]
+        self.matcher = CompiledMatcher(self._sections)
+
+    def __len__(self) -> int:
+        return self.header["entries"]
+
+    def entry(self, idx: int) -> dict:
+        offsets = self._sections["translation_offsets"]
+        blob = self._sections["translation_blob"]
+        return {
+            "translation": bytes(blob[offsets[idx]:offsets[idx + 1]]).decode("utf-8"),
+            "level": self._levels[self._sections["level"][idx]],
+        }
+
+
+def load_snapshot(path: Path = INDEX_PATH, strict: bool = False) -> DictionarySnapshot:
+    """加载快照；不存在、格式不对或源 JSON 已变化时先重建（strict 同 load_dictionaries）"""
+    digest = source_hash()
+    try:
+        snapshot = DictionarySnapshot(path)
+        header = snapshot.header
+        if (
+            header.get("format") == INDEX_FORMAT
+            and header.get("byteorder") == sys.byteorder
+            and snapshot.source_hash == digest
+        ):
+            return snapshot
+        print("Dictionary index outdated, rebuilding...")
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        print(f"Dictionary index unavailable ({e}), building...")
+    build_index(path, strict)
+    return DictionarySnapshot(path)
+
+
+if __name__ == "__main__":
+    build_index()
@@ -0,0 +1,157 @@
+"""
+增量 JSON 数组解析 — 边接收模型的 token 流边取出已完整的顶层对象
+
+模型输出形如 [{...}, {...}, ...]，可能带 ```json 代码块、前后说明文字，
+结构化输出时外面还包一层 {"items": [...]}，也可能在 maxOutputTokens 处被截断。
+JsonArrayStream 只关心第一个数组的直接元素 {...}：每个对象的右括号一到
+就解析并返回，截断时已完整的对象自然都保留下来。
+"""
+
+import json
+import re
+
+# 不同状态下需要关注的字符：数组开始前只找 [，字符串内只看引号和转义，
+# 数组内、对象外只看 { 和 ]，对象内看括号和引号
+_ARRAY_START = re.compile(r'\[')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ARRAY_SPECIAL = re.compile(r'[{\]]')
+_OBJECT_SPECIAL = re.compile(r'["{}\[\]]')
+
+
+class JsonArrayStream:
+    """
+    用法：
+        stream = JsonArrayStream()
+        for text in deltas:
+            for obj in stream.feed(text):
+                ...
+    stream.items 累积所有已解析的对象
+    """
+
+    def __init__(self):
+        self.items: list[dict] = []
+        self._buf = ""
+        self._pos = 0          # 下一个待扫描字符在 _buf 中的位置
+        self._start = 0        # 当前对象 { 在 _buf 中的位置
+        self._depth = 0        # 0 = 不在数组元素对象内
+        self._in_array = False
+        self._done = False     # 数组已闭合，之后的内容忽略
+        self._in_string = False
+        self._escape = False   # 上一个 chunk 以反斜杠结尾
+
+    def feed(self, text: str) -> list[dict]:
+        """追加一段文本，返回本次新完成的对象"""
+        if self._done:
+            return []
+        buf = self._buf + text
+        pos = self._pos
+        new_items = []
+
+        if self._escape and pos < len(buf):
+            pos += 1
+            self._escape = False
+
+        while pos < len(buf):
+            if self._in_string:
+                m = _STRING_SPECIAL.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == "\\":
+                    if m.end() >= len(buf):
+                        self._escape = True
+                        pos = len(buf)
+                        break
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                pos = m.end()
+                continue
+
+            if not self._in_array:
+                m = _ARRAY_START.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                self._in_array = True
+                pos = m.end()
+                continue
+
+            if self._depth == 0:
+                m = _ARRAY_SPECIAL.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == "]":
+                    self._done = True
+                    break
+                self._start = m.start()
+                self._depth = 1
+                pos = m.end()
+                continue
+
+            m = _OBJECT_SPECIAL.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            c = m.group()
+            pos = m.end()
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = json.loads(buf[self._start:pos])
+                    except json.JSONDecodeError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        new_items.append(obj)
+
+        # 丢掉已经处理完的前缀，只保留未完成的对象
+        if self._done or self._depth == 0:
+            self._buf, self._pos = "", 0
+        else:
+            self._buf = buf[self._start:]
+            self._pos = pos - self._start
+            self._start = 0
+
+        self.items.extend(new_items)
+        return new_items
+
+
+def strip_code_fence(content: str) -> str:
+    content = content.strip()
+    if content.startswith("```"):
+        content = re.sub(r'^```\w*\n?', '', content)
+        content = re.sub(r'\n?```$', '', content)
+        content = content.strip()
+    return content
+
+
+def parse_json_array(content: str, label: str) -> list[dict]:
+    """
+    解析模型输出的 JSON 数组；不是合法 JSON（截断、尾逗号等）时
+    退回增量解析，保留所有完整的对象。一个完整对象都没有时抛 ValueError
+
+    结构化输出的 {"items": [...]} 包装会自动拆开
+    """
+    content = strip_code_fence(content)
+    try:
+        items = json.loads(content)
+    except json.JSONDecodeError as e:
+        items = JsonArrayStream().feed(content)
+        if not items:
+            raise ValueError(f"Cannot parse {label} JSON: {str(e)[:200]}")
+        print(f"{label} JSON invalid ({str(e)[:100]}), salvaged {len(items)} complete objects")
+        return items
+
+    if isinstance(items, dict):
+        arrays = [value for value in items.values() if isinstance(value, list)]
+        if len(arrays) == 1:
+            items = arrays[0]
+    if not isinstance(items, list):
+        raise ValueError(f"{label} JSON is not an array: {type(items).__name__}")
+    return items
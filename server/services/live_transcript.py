@@ -0,0 +1,101 @@
+"""
+直播 / 首映字幕的增量处理
+
+字幕不断追加：只重新合并末尾未定稿的段落（IncrementalMerger），只给新定稿的段落加高亮，
+只为新凑满的 chunk 触发 AI 高亮 / 上下文注释，每次追加的工作量与直播已进行的时长无关。
+会话按 video_id 保存在进程内，长时间没有追加的会话自动清理。
+"""
+
+import time
+
+from server.services.ai_pipeline import (
+    chunk_input_budget,
+    CONTEXT_NOTES_MODELS, CONTEXT_NOTES_CHUNK_BUDGET, HIGHLIGHTS_MODELS, HIGHLIGHTS_CHUNK_BUDGET,
+)
+from server.services.chunk_planner import take_complete_chunks
+from server.services.transcript_fetch import IncrementalMerger
+from server.services.word_highlighter import current_dictionary, iter_highlight_segments
+
+# 多久没有追加就丢弃会话（秒）
+LIVE_SESSION_IDLE_SECONDS = 3600.0
+
+_sessions: dict[str, "LiveTranscript"] = {}
+
+
+class LiveTranscript:
+    """
+    一场直播的增量状态：已定稿的段落、词典快照、各 AI 任务已经处理到的段落位置
+
+    用法:
+        live = LiveTranscript(video_id)
+        update = live.append(raw_segments)
+        update["segments"]              # 新定稿并已高亮的段落，全局下标从 update["start_idx"] 开始
+        update["chunks"]["highlights"]  # 待生成的 chunk [(start_idx, chunk_segs), ...]
+        live.requeue("highlights", start_idx, chunk_segs)  # 生成失败 / 被取消，下次追加时重新下发
+    """
+
+    def __init__(self, video_id: str):
+        self.video_id = video_id
+        self.merger = IncrementalMerger()
+        # 整场直播用同一份词典快照，前后段落的高亮保持一致
+        self.dictionary = current_dictionary()
+        self.chunk_budgets = {
+            "highlights": chunk_input_budget(HIGHLIGHTS_MODELS, HIGHLIGHTS_CHUNK_BUDGET),
+            "context_notes": chunk_input_budget(CONTEXT_NOTES_MODELS, CONTEXT_NOTES_CHUNK_BUDGET),
+        }
+        self._chunk_cursor = {task: 0 for task in self.chunk_budgets}
+        # 已下发但没生成成功的 chunk，下次追加时排在新 chunk 前面重新下发
+        self._pending = {task: [] for task in self.chunk_budgets}
+        self.touched_at = time.monotonic()
+
+    @property
+    def segments(self) -> list[dict]:
+        """所有已定稿的段落（已高亮）"""
+        return self.merger.paragraphs
+
+    def append(self, raw_segments: list[dict], final: bool = False) -> dict:
+        """
+        追加原始字幕 [{text, start, duration}]；final=True 表示直播结束，剩余内容全部定稿
+
+        返回: {"start_idx", "segments": 新定稿的段落, "chunks": {task: [(start_idx, chunk_segs), ...]}}
+        chunks 包括之前 requeue 的 chunk 和新凑满的 chunk
+        """
+        self.touched_at = time.monotonic()
+        start_idx = len(self.merger.paragraphs)
+        new_paragraphs = self.merger.feed(raw_segments)
+        if final:
+            new_paragraphs += self.merger.flush()
+        # 段落对象与 merger.paragraphs 共享，原地加上 highlights
+        new_paragraphs = list(iter_highlight_segments(new_paragraphs, dictionary=self.dictionary))
+
+        chunks = {}
+        for task, max_tokens in self.chunk_budgets.items():
+            task_chunks = take_complete_chunks(self.segments, self._chunk_cursor[task], max_tokens, final)
+            if task_chunks:
+                last_start, last_segs = task_chunks[-1]
+                self._chunk_cursor[task] = last_start + len(last_segs)
+            chunks[task] = self._pending[task] + task_chunks
+            self._pending[task] = []
+
+        return {"start_idx": start_idx, "segments": new_paragraphs, "chunks": chunks}
+
+    def requeue(self, task: str, start_idx: int, chunk_segs: list[dict]) -> None:
+        """append 下发的 chunk 没能生成（出错或客户端断开），放回待处理列表"""
+        self._pending[task].append((start_idx, chunk_segs))
+
+
+def get_session(video_id: str) -> LiveTranscript:
+    """取 video_id 的直播会话，没有则新建；顺便清理闲置会话"""
+    now = time.monotonic()
+    for vid in [vid for vid, live in _sessions.items() if now - live.touched_at > LIVE_SESSION_IDLE_SECONDS]:
+        print(f"Live session {vid} idle, dropped")
+        del _sessions[vid]
+
+    live = _sessions.get(video_id)
+    if live is None:
+        live = _sessions[video_id] = LiveTranscript(video_id)
+    return live
+
+
+def end_session(video_id: str) -> None:
+    _sessions.pop(video_id, None)
@@ -0,0 +1,153 @@
+"""
+LLM Provider HTTP 客户端 — 进程内共享的长连接池
+
+每个 provider 一个长期存活的 httpx.AsyncClient / AsyncOpenAI，避免每次调用都重新
+TCP + TLS 握手。超时和连接池大小可通过环境变量配置：
+
+    LLM_CONNECT_TIMEOUT  建立连接超时（秒），默认 10
+    LLM_READ_TIMEOUT     读超时（秒，两次收到数据之间的最长间隔），默认 600
+    LLM_POOL_SIZE        每个 provider 保持的 keep-alive 连接数，默认 8
+                         （覆盖 highlight 并发 4 + analyze 并发，再留余量）
+    LLM_ASYNC_MAX_CONNECTIONS  异步 client 每个 provider 的最大并发连接数，默认 100
+
+client 绑定事件循环，按 (loop, provider) 缓存：循环被回收后缓存条目随之消失，
+应用关闭时用 aclose_clients() 关闭当前循环上的连接。
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+
+_lock = threading.Lock()
+# 事件循环 → {provider: client}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, object]]" = weakref.WeakKeyDictionary()
+# 各 provider 的请求 / 新建连接计数
+_httpx_stats: dict[str, dict] = {}
+
+
+def connect_timeout() -> float:
+    return float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+
+
+def read_timeout() -> float:
+    return float(os.getenv("LLM_READ_TIMEOUT", "600"))
+
+
+def pool_size() -> int:
+    return int(os.getenv("LLM_POOL_SIZE", "8"))
+
+
+def async_max_connections() -> int:
+    return int(os.getenv("LLM_ASYNC_MAX_CONNECTIONS", "100"))
+
+
+def _count(provider: str, key: str):
+    with _lock:
+        stats = _httpx_stats.setdefault(provider, {"requests": 0, "new_connections": 0})
+        stats[key] += 1
+
+
+def _httpx_event_hooks(provider: str) -> dict:
+    """通过 httpcore 的 trace 扩展统计新建连接数"""
+    async def trace(event_name: str, info: dict):
+        if event_name.endswith("connect_tcp.complete"):
+            _count(provider, "new_connections")
+
+    async def on_request(request):
+        _count(provider, "requests")
+        request.extensions["trace"] = trace
+
+    return {"request": [on_request]}
+
+
+def _httpx_timeout():
+    import httpx
+
+    return httpx.Timeout(read_timeout(), connect=connect_timeout())
+
+
+def _async_limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=async_max_connections(),
+        max_keepalive_connections=pool_size(),
+    )
+
+
+def _loop_clients() -> dict[str, object]:
+    """当前事件循环的 client 表（同一循环内没有并发，只有跨线程的不同循环需要加锁）"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.get(loop)
+        if clients is None:
+            clients = _async_clients[loop] = {}
+        return clients
+
+
+def get_async_client(provider: str):
+    """获取当前事件循环上 provider 专用的 httpx.AsyncClient"""
+    import httpx
+
+    clients = _loop_clients()
+    client = clients.get(provider)
+    if client is None:
+        client = clients[provider] = httpx.AsyncClient(
+            limits=_async_limits(),
+            timeout=_httpx_timeout(),
+            event_hooks=_httpx_event_hooks(provider),
+        )
+    return client
+
+
+def get_async_openai_client():
+    """获取当前事件循环上共享的 AsyncOpenAI client"""
+    import httpx
+    from openai import AsyncOpenAI
+
+    clients = _loop_clients()
+    client = clients.get("openai")
+    if client is None:
+        timeout = _httpx_timeout()
+        client = clients["openai"] = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                limits=_async_limits(),
+                timeout=timeout,
+                event_hooks=_httpx_event_hooks("openai"),
+            ),
+            timeout=timeout,
+        )
+    return client
+
+
+async def aclose_clients():
+    """关闭当前事件循环上的所有 client（应用 / CLI 退出前调用）"""
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        # httpx.AsyncClient 用 aclose()，AsyncOpenAI 用 close()
+        close = getattr(client, "aclose", None) or client.close
+        await close()
+
+
+def connection_stats() -> dict[str, dict]:
+    """
+    各 provider 的连接复用统计
+
+    返回: {provider: {"requests", "new_connections", "reuse_ratio"}}
+    reuse_ratio = 复用已有连接的请求占比
+    """
+    with _lock:
+        raw = {provider: dict(counts) for provider, counts in _httpx_stats.items()}
+
+    stats = {}
+    for provider, counts in raw.items():
+        total = counts["requests"]
+        reused = max(total - counts["new_connections"], 0)
+        stats[provider] = {
+            **counts,
+            "reuse_ratio": round(reused / total, 3) if total else None,
+        }
+    return stats
@@ -0,0 +1,179 @@
+"""
+多模式短语匹配 — Aho-Corasick 自动机
+
+词典加载时构建一次，之后对每段文本只扫描一遍，复杂度与词典大小无关：
+O(文本长度 + 命中数)。匹配按 \\b 语义检查词边界，冲突时由调用方决定取舍。
+文本和 pattern 都先经 fold_case 转小写，命中的位置可以直接用于切原文。
+
+PhraseMatcher 用 dict 存转移，适合小词表和构建；tables() 导出扁平数组，
+CompiledMatcher 直接在这些数组（可以是 mmap 的 memoryview）上匹配。
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+
+_WORD_BOUNDARY = re.compile(r"\b")
+
+
+def fold_case(text: str) -> str:
+    """
+    长度不变的小写：逐字符 lower()，结果不止一个字符的（如 "İ" → "i̇"）保持原样，
+    保证下标与原文一一对应
+
+        fold_case("İstanbul Circle Back")  # "İstanbul circle back"，len 不变
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(low if len(low := ch.lower()) == 1 else ch for ch in text)
+
+
+class PhraseMatcher:
+    """
+    用法：
+        matcher = PhraseMatcher(["circle back", "touch base"])
+        matcher.find_all("let's circle back")  # [(6, 17, 0)]
+
+    patterns 应已经过 fold_case；pattern id 即其在列表中的下标，重复的 pattern 只保留第一个
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.lengths = [len(p) for p in patterns]
+        self._goto: list[dict[str, int]] = [{}]
+        self._out: list[int] = [-1]        # 在该节点结束的 pattern id，没有为 -1
+        for pid, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._out.append(-1)
+                node = nxt
+            if self._out[node] < 0:
+                self._out[node] = pid
+        self._build_links()
+
+    def _build_links(self):
+        """BFS 计算失配指针和输出链（沿失配链最近的有输出的节点）"""
+        size = len(self._goto)
+        self._fail = [0] * size
+        self._dict_link = [0] * size
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                fail_node = self._fail[child]
+                self._dict_link[child] = fail_node if self._out[fail_node] >= 0 else self._dict_link[fail_node]
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def find_all(self, text: str) -> list[tuple[int, int, int]]:
+        """
+        返回所有满足词边界的命中 [(start, end, pattern_id), ...]（可能互相重叠）
+        text 应已经过 fold_case
+        """
+        goto, fail, out, dict_link, lengths = self._goto, self._fail, self._out, self._dict_link, self.lengths
+        boundaries = {m.start() for m in _WORD_BOUNDARY.finditer(text)}
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if out[node] >= 0 else dict_link[node]
+            while hit:
+                pid = out[hit]
+                end = i + 1
+                start = end - lengths[pid]
+                if start in boundaries and end in boundaries:
+                    matches.append((start, end, pid))
+                hit = dict_link[hit]
+        return matches
+
+    def tables(self) -> dict[str, array]:
+        """
+        导出扁平表（CSR 格式）：节点 n 的出边为 edge_chars / edge_targets 的
+        [edge_start[n], edge_start[n+1]) 区间，按字符码点升序
+        """
+        edge_start = array("I", [0])
+        edge_chars = array("I")
+        edge_targets = array("I")
+        for edges in self._goto:
+            for ch, target in sorted(edges.items()):
+                edge_chars.append(ord(ch))
+                edge_targets.append(target)
+            edge_start.append(len(edge_chars))
+        return {
+            "edge_start": edge_start,
+            "edge_chars": edge_chars,
+            "edge_targets": edge_targets,
+            "fail": array("I", self._fail),
+            "out": array("i", self._out),
+            "dict_link": array("I", self._dict_link),
+            "lengths": array("I", self.lengths),
+        }
+
+
+class CompiledMatcher:
+    """
+    在 PhraseMatcher.tables() 导出的扁平表上匹配，结果与 PhraseMatcher.find_all 相同
+
+    tables 的值可以是 array 或 memoryview（mmap 的快照文件），不会复制数据；
+    只有根节点的出边展开成 dict（绝大多数字符都从根节点转移）
+    """
+
+    def __init__(self, tables: dict):
+        self._edge_start = tables["edge_start"]
+        self._edge_chars = tables["edge_chars"]
+        self._edge_targets = tables["edge_targets"]
+        self._fail = tables["fail"]
+        self._out = tables["out"]
+        self._dict_link = tables["dict_link"]
+        self.lengths = tables["lengths"]
+        root_end = self._edge_start[1]
+        self._root = {self._edge_chars[k]: self._edge_targets[k] for k in range(root_end)}
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def find_all(self, text: str) -> list[tuple[int, int, int]]:
+        """同 PhraseMatcher.find_all"""
+        edge_start, edge_chars, edge_targets = self._edge_start, self._edge_chars, self._edge_targets
+        fail, out, dict_link, lengths, root = self._fail, self._out, self._dict_link, self.lengths, self._root
+        boundaries = {m.start() for m in _WORD_BOUNDARY.finditer(text)}
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            c = ord(ch)
+            while node:
+                lo, hi = edge_start[node], edge_start[node + 1]
+                k = bisect_left(edge_chars, c, lo, hi)
+                if k < hi and edge_chars[k] == c:
+                    node = edge_targets[k]
+                    break
+                node = fail[node]
+            else:
+                node = root.get(c, 0)
+            hit = node if out[node] >= 0 else dict_link[node]
+            while hit:
+                pid = out[hit]
+                end = i + 1
+                start = end - lengths[pid]
+                if start in boundaries and end in boundaries:
+                    matches.append((start, end, pid))
+                hit = dict_link[hit]
+        return matches
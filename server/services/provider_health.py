@@ -0,0 +1,189 @@
+"""
+Provider 健康度注册表 — 进程内共享
+
+按 "provider/model" 记录最近调用的成败和延迟，用于：
+- 对冲调用计算延迟分位数
+- 熔断：连续失败 FAILURE_THRESHOLD 次后跳过该模型 COOLDOWN_SECONDS 秒，
+  冷却结束后放行一个探测请求（half-open），成功则恢复，失败则重新熔断
+- 按延迟 + 错误率给 fallback 列表动态排序
+- 统计输入 token 以及命中 provider 侧 prompt cache 的 token
+"""
+
+import threading
+import time
+from collections import deque
+
+LATENCY_WINDOW = 100     # 每个 provider/model 保留最近多少次成功调用的延迟
+OUTCOME_WINDOW = 20      # 计算错误率的滚动窗口
+MIN_SAMPLES = 5          # 样本少于此数时不给出分位数、不参与延迟排序
+FAILURE_THRESHOLD = 3    # 连续失败多少次熔断
+COOLDOWN_SECONDS = 60.0  # 熔断持续时间
+ERROR_PENALTY = 4.0      # 排序得分 = p50 延迟 × (1 + ERROR_PENALTY × 错误率)
+
+_lock = threading.Lock()
+_health: dict[str, dict] = {}
+
+
+def _entry(label: str) -> dict:
+    entry = _health.get(label)
+    if entry is None:
+        entry = _health[label] = {
+            "latencies": deque(maxlen=LATENCY_WINDOW),
+            "outcomes": deque(maxlen=OUTCOME_WINDOW),
+            "consecutive_failures": 0,
+            "opened_at": None,
+            "probing": False,
+            "input_tokens": 0,
+            "cached_input_tokens": 0,
+        }
+    return entry
+
+
+def _state(entry: dict, now: float) -> str:
+    if entry["opened_at"] is None:
+        return "closed"
+    if now - entry["opened_at"] < COOLDOWN_SECONDS:
+        return "open"
+    return "half_open"
+
+
+def _percentile(samples: list[float], percentile: float) -> float | None:
+    if len(samples) < MIN_SAMPLES:
+        return None
+    samples = sorted(samples)
+    rank = min(int(len(samples) * percentile / 100), len(samples) - 1)
+    return samples[rank]
+
+
+def _error_rate(entry: dict) -> float | None:
+    outcomes = entry["outcomes"]
+    if not outcomes:
+        return None
+    return sum(1 for ok in outcomes if not ok) / len(outcomes)
+
+
+def record_success(label: str, seconds: float) -> None:
+    """记录一次成功调用，label 形如 "gemini/gemini-2.5-flash" """
+    with _lock:
+        entry = _entry(label)
+        entry["latencies"].append(seconds)
+        entry["outcomes"].append(True)
+        entry["consecutive_failures"] = 0
+        entry["opened_at"] = None
+        entry["probing"] = False
+
+
+def record_failure(label: str) -> None:
+    """记录一次失败调用，连续失败达到阈值或探测失败时熔断"""
+    with _lock:
+        entry = _entry(label)
+        entry["outcomes"].append(False)
+        entry["consecutive_failures"] += 1
+        was_probing = entry["probing"]
+        entry["probing"] = False
+        if was_probing or entry["consecutive_failures"] >= FAILURE_THRESHOLD:
+            entry["opened_at"] = time.monotonic()
+
+
+def record_usage(label: str, input_tokens: int, cached_tokens: int) -> None:
+    """记录一次调用的输入 token 数和其中命中 prompt cache 的部分"""
+    with _lock:
+        entry = _entry(label)
+        entry["input_tokens"] += input_tokens
+        entry["cached_input_tokens"] += cached_tokens
+
+
+def acquire(label: str) -> bool:
+    """
+    调用前检查是否放行：closed 放行；open 拒绝；
+    half_open 只放行一个探测请求，其余拒绝直到探测有结果
+    """
+    with _lock:
+        entry = _health.get(label)
+        if entry is None:
+            return True
+        state = _state(entry, time.monotonic())
+        if state == "closed":
+            return True
+        if state == "open" or entry["probing"]:
+            return False
+        entry["probing"] = True
+        return True
+
+
+def release(label: str) -> None:
+    """调用被取消（没有结果）时释放 half_open 探测名额"""
+    with _lock:
+        entry = _health.get(label)
+        if entry is not None:
+            entry["probing"] = False
+
+
+def latency_percentile(label: str, percentile: float) -> float | None:
+    """最近成功调用延迟的分位数（percentile 取 0-100），样本不足返回 None"""
+    with _lock:
+        entry = _health.get(label)
+        samples = list(entry["latencies"]) if entry else []
+    return _percentile(samples, percentile)
+
+
+def order_models(model_priority: list) -> list:
+    """
+    按健康度重排 fallback 列表 [(provider, model), ...]
+
+    熔断中的模型排到最后；有足够延迟样本的模型按得分（p50 × 错误率惩罚）
+    在它们原本占据的位置之间重排；样本不足的模型保持配置位置
+    """
+    now = time.monotonic()
+    available_slots: list[int] = []
+    scored: list[tuple[float, int]] = []
+    tripped: list[int] = []
+
+    with _lock:
+        for idx, (provider, model) in enumerate(model_priority):
+            entry = _health.get(f"{provider}/{model}")
+            if entry is None:
+                continue
+            if _state(entry, now) == "open":
+                tripped.append(idx)
+                continue
+            p50 = _percentile(list(entry["latencies"]), 50)
+            if p50 is None:
+                continue
+            error_rate = _error_rate(entry) or 0.0
+            available_slots.append(idx)
+            scored.append((p50 * (1 + ERROR_PENALTY * error_rate), idx))
+
+    ordered = list(model_priority)
+    for slot, (_, idx) in zip(available_slots, sorted(scored)):
+        ordered[slot] = model_priority[idx]
+
+    tripped_models = [model_priority[idx] for idx in tripped]
+    return [m for m in ordered if m not in tripped_models] + tripped_models
+
+
+def snapshot() -> dict[str, dict]:
+    """各 provider/model 的当前健康状态，供 /api/metrics/providers 展示"""
+    now = time.monotonic()
+    result = {}
+    with _lock:
+        for label, entry in sorted(_health.items()):
+            state = _state(entry, now)
+            latencies = list(entry["latencies"])
+            error_rate = _error_rate(entry)
+            p50 = _percentile(latencies, 50)
+            p95 = _percentile(latencies, 95)
+            result[label] = {
+                "state": state,
+                "calls": len(entry["outcomes"]),
+                "error_rate": round(error_rate, 3) if error_rate is not None else None,
+                "p50_seconds": round(p50, 2) if p50 is not None else None,
+                "p95_seconds": round(p95, 2) if p95 is not None else None,
+                "consecutive_failures": entry["consecutive_failures"],
+                "input_tokens": entry["input_tokens"],
+                "cached_input_tokens": entry["cached_input_tokens"],
+                "reopen_in_seconds": (
+                    round(COOLDOWN_SECONDS - (now - entry["opened_at"]), 1) if state == "open" else None
+                ),
+            }
+    return result
@@ -2,9 +2,35 @@
 YouTube 字幕提取服务
 """
 
+import os
 import re
+import json
+import hashlib
+from bisect import bisect_right
+from typing import Iterator
 from urllib.parse import urlparse, parse_qs
 
+from server.services.cache_store import get_cache, get_cache_with_age, set_cache, set_many, touch_cache
+
+# 原始字幕缓存多久后重新向 YouTube 确认（小时）；过期后若内容没变只刷新时间戳
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL_HOURS", "24")) * 3600
+# merge_segments 算法变化时递增，使旧的合并结果失效
+MERGE_VERSION = 2
+# 相邻字幕之间超过这么多秒的停顿强制分段
+PAUSE_GAP_SECONDS = float(os.getenv("TRANSCRIPT_PAUSE_GAP", "3.0"))
+# 段落切分方式的标识：AI 高亮 / 注释按段落下标和字符位置缓存，切分变了旧结果就对不上，
+# 这些缓存的模块名都带上它
+SEGMENTATION_TAG = f"v{MERGE_VERSION}:{PAUSE_GAP_SECONDS:g}"
+
+# 直播增量合并：末尾保留多少个段落不定稿，以及未定稿文本的上限（字符）
+LIVE_OPEN_PARAGRAPHS = 2
+LIVE_TAIL_MAX_CHARS = 2000
+
+# 句末标点后跟空格或结尾
+_SENTENCE_END = re.compile(r'[.?!](?:\s|$)')
+
+DEFAULT_LANGUAGES = ["en", "en-US", "en-GB"]
+
 
 class NoCaptionsError(Exception):
     """视频没有可用字幕"""
@@ -44,7 +70,7 @@ def fetch_transcript(video_id: str, languages: list[str] = None) -> list[dict]:
     from youtube_transcript_api import YouTubeTranscriptApi
 
     if languages is None:
-        languages = ["en", "en-US", "en-GB"]
+        languages = DEFAULT_LANGUAGES
 
     ytt = YouTubeTranscriptApi()
 
@@ -81,73 +107,135 @@ def fetch_transcript(video_id: str, languages: list[str] = None) -> list[dict]:
     ]
 
 
-def merge_segments(segments: list[dict], soft_max: int = 200, hard_max: int = 500) -> list[dict]:
+def merge_segments(
+    segments: list[dict],
+    soft_max: int = 200,
+    hard_max: int = 500,
+    pause_gap: float | None = PAUSE_GAP_SECONDS,
+) -> list[dict]:
     """
     将碎片化的字幕段落合并为可读的段落块
 
     思路: 先把所有 segment 合并成完整文本，用正则找到所有句子边界，
     然后按 soft_max/hard_max 把句子分组为段落，最后根据字符偏移
-    反查对应的时间戳。
+    反查对应的时间戳。超过 pause_gap 秒的停顿处强制分段（None 或 0 关闭）。
     """
-    if not segments:
-        return []
+    return list(iter_merge_segments(segments, soft_max, hard_max, pause_gap))
 
-    # Step 1: 构建字符偏移 → 时间戳的映射
-    # 把所有 segment 拼成完整文本，同时记录每个字符对应的时间
-    full_text = ""
-    char_times = []  # char_times[i] = 该字符对应的 start 时间
-    char_ends = []   # char_ends[i] = 该字符对应的 segment end 时间
+
+def iter_merge_segments(
+    segments: list[dict],
+    soft_max: int = 200,
+    hard_max: int = 500,
+    pause_gap: float | None = PAUSE_GAP_SECONDS,
+) -> Iterator[dict]:
+    """
+    merge_segments 的生成器版本：段落一确定就产出，长字幕不必等全部合并完
+    """
+    for _, para in _iter_paragraphs(segments, soft_max, hard_max, pause_gap):
+        yield para
+
+
+def _iter_paragraphs(
+    segments: list[dict],
+    soft_max: int,
+    hard_max: int,
+    pause_gap: float | None,
+) -> Iterator[tuple[int, dict]]:
+    """
+    合并算法本体，产出 (段落在拼接文本中的起始位置, 段落)
+
+    拼接文本 = 所有非空 segment strip 后用单个空格连接，IncrementalMerger 据此把未定稿的段落还原成 segment。
+    每个停顿区间内最后一个段落可能还要并入过短的尾巴，所以始终压住一个段落（pending）晚一步产出
+    """
+    if not segments:
+        return
+
+    # Step 1: 构建字符偏移 → 时间戳的映射，同时记录停顿分段点
+    # 把所有 segment 用空格拼成完整文本，只记录每个 segment 在 full_text 中的起始偏移
+    # （连接用的空格算作后一个 segment），字符位置的时间用 bisect 反查
+    pieces = []
+    seg_offsets = []  # seg_offsets[k] = 第 k 个非空 segment（含前导空格）的起始字符位置
+    seg_starts = []
+    seg_ends = []
+    breaks = [0]      # 停顿分段点：段落不会跨越这些位置
+    length = 0
 
     for seg in segments:
         text = seg["text"].strip()
         if not text:
             continue
-        seg_start = seg["start"]
-        seg_end = seg["start"] + seg["duration"]
-        if full_text:
-            # 加空格连接
-            full_text += " "
-            char_times.append(seg_start)
-            char_ends.append(seg_end)
-        for _ in text:
-            char_times.append(seg_start)
-            char_ends.append(seg_end)
-        full_text += text
-
-    if not full_text:
-        return []
-
-    # Step 2: 找到所有句子边界位置（句末标点后跟空格或字符串结尾）
-    sentence_ends = []  # 每个元素是句末标点后的字符位置（切分点）
-    for m in re.finditer(r'[.?!](?:\s|$)', full_text):
-        # 切分点在标点后面的空格之后
-        end_pos = m.end()
-        sentence_ends.append(end_pos)
+        # Step 4: 处理时间间隔过大的情况（> pause_gap 秒的停顿应该分段）
+        # 停顿前的文本太短时不分，避免产生只有几个词的段落
+        if (
+            pause_gap
+            and seg_ends
+            and seg["start"] - seg_ends[-1] > pause_gap
+            and length - breaks[-1] >= soft_max * 0.4
+        ):
+            breaks.append(length)
+        seg_offsets.append(length)
+        seg_starts.append(seg["start"])
+        seg_ends.append(seg["start"] + seg["duration"])
+        if pieces:
+            length += 1
+        pieces.append(text)
+        length += len(text)
+
+    if not pieces:
+        return
+    full_text = " ".join(pieces)
+    del pieces
+
+    def start_at(pos: int) -> float:
+        """字符 pos 所在 segment 的 start 时间"""
+        return seg_starts[bisect_right(seg_offsets, pos) - 1]
+
+    def end_at(pos: int) -> float:
+        """字符 pos 所在 segment 的 end 时间"""
+        return seg_ends[bisect_right(seg_offsets, pos) - 1]
+
+    pending = None
+    breaks.append(len(full_text))
+    for span_start, span_end in zip(breaks, breaks[1:]):
+        # 段落和尾巴合并都不跨越停顿
+        if pending is not None:
+            yield pending
+            pending = None
+
+        # Step 2: 找到停顿区间内所有句子边界位置（句末标点后跟空格或区间结尾）
+        sentence_ends = []  # 每个元素是句末标点后的字符位置（切分点）
+        for m in _SENTENCE_END.finditer(full_text, span_start, span_end):
+            # 切分点在标点后面的空格之后
+            end_pos = m.end()
+            sentence_ends.append(end_pos)
+
+        # Step 3: 按句子边界分段，尊重 soft_max 和 hard_max
+        para_start = span_start  # 当前段落在 full_text 中的起始位置
+
+        if not sentence_ends:
+            # 没有句末标点，按 hard_max 强制切分
+            while para_start < span_end:
+                end = min(para_start + hard_max, span_end)
+                # 尝试在空格处切
+                if end < span_end:
+                    space_pos = full_text.rfind(" ", para_start, end)
+                    if space_pos > para_start:
+                        end = space_pos + 1
+                text = full_text[para_start:end].strip()
+                if text:
+                    if pending is not None:
+                        yield pending
+                    pending = (para_start, {
+                        "text": text,
+                        "start": start_at(para_start),
+                        "duration": end_at(end - 1) - start_at(para_start),
+                    })
+                para_start = end
+            continue
 
-    # Step 3: 按句子边界分段，尊重 soft_max 和 hard_max
-    merged = []
-    para_start = 0  # 当前段落在 full_text 中的起始位置
-
-    if not sentence_ends:
-        # 没有句末标点，按 hard_max 强制切分
-        while para_start < len(full_text):
-            end = min(para_start + hard_max, len(full_text))
-            # 尝试在空格处切
-            if end < len(full_text):
-                space_pos = full_text.rfind(" ", para_start, end)
-                if space_pos > para_start:
-                    end = space_pos + 1
-            text = full_text[para_start:end].strip()
-            if text:
-                merged.append({
-                    "text": text,
-                    "start": char_times[para_start],
-                    "duration": char_ends[min(end - 1, len(char_ends) - 1)] - char_times[para_start],
-                })
-            para_start = end
-    else:
         se_idx = 0  # sentence_ends 的索引
-        while para_start < len(full_text) and se_idx <= len(sentence_ends):
+        while para_start < span_end and se_idx <= len(sentence_ends):
             # 从 para_start 开始，累积句子直到超过 soft_max
             best_end = None
 
@@ -167,51 +255,223 @@ def merge_segments(segments: list[dict], soft_max: int = 200, hard_max: int = 50
 
             # 如果没有更多句子边界了，把剩余文本全部收入
             if se_idx >= len(sentence_ends) and best_end is not None:
-                remaining_text = full_text[best_end:].strip()
+                remaining_text = full_text[best_end:span_end].strip()
                 if remaining_text:
                     # 剩余部分不够组成新段落，合并到当前段
                     if len(remaining_text) < soft_max * 0.4:
-                        best_end = len(full_text)
+                        best_end = span_end
                         se_idx = len(sentence_ends) + 1  # 标记结束
 
             if best_end is None:
-                best_end = len(full_text)
+                best_end = span_end
 
             text = full_text[para_start:best_end].strip()
             if text:
-                start_idx = para_start
-                end_idx = min(best_end - 1, len(char_times) - 1)
-                merged.append({
+                if pending is not None:
+                    yield pending
+                pending = (para_start, {
                     "text": text,
-                    "start": char_times[start_idx],
-                    "duration": char_ends[end_idx] - char_times[start_idx],
+                    "start": start_at(para_start),
+                    "duration": end_at(best_end - 1) - start_at(para_start),
                 })
 
             para_start = best_end
-            if para_start >= len(full_text):
+            if para_start >= span_end:
                 break
 
         # 处理最后剩余的文本（在最后一个句子边界之后）
-        if para_start < len(full_text):
-            text = full_text[para_start:].strip()
+        if para_start < span_end:
+            text = full_text[para_start:span_end].strip()
             if text:
-                if merged and len(text) < soft_max * 0.4:
+                if pending is not None and len(text) < soft_max * 0.4:
                     # 太短，合并到上一段
-                    merged[-1]["text"] += " " + text
-                    merged[-1]["duration"] = char_ends[-1] - merged[-1]["start"]
+                    para = pending[1]
+                    para["text"] += " " + text
+                    para["duration"] = end_at(span_end - 1) - para["start"]
                 else:
-                    merged.append({
+                    if pending is not None:
+                        yield pending
+                    pending = (para_start, {
                         "text": text,
-                        "start": char_times[para_start],
-                        "duration": char_ends[-1] - char_times[para_start],
+                        "start": start_at(para_start),
+                        "duration": end_at(span_end - 1) - start_at(para_start),
                     })
 
-    # Step 4: 处理时间间隔过大的情况（> 3秒的停顿应该分段）
-    final = []
-    for para in merged:
-        final.append(para)
+    if pending is not None:
+        yield pending
 
-    return final
+
+# --------------- 增量合并（直播 / 首映） ---------------
+
+class IncrementalMerger:
+    """
+    直播字幕不断追加，只重新合并末尾还没定稿的部分
+
+    用法:
+        merger = IncrementalMerger()
+        new_paragraphs = merger.feed(raw_segments)   # 本次新定稿的段落
+        ...
+        new_paragraphs = merger.flush()              # 直播结束，剩余段落全部定稿
+
+    末尾 LIVE_OPEN_PARAGRAPHS 个段落暂不定稿：最后一个可能还会并入过短的尾巴，
+    倒数第二个在句子用完时可能还会继续累积。已定稿的段落不再改变，
+    标点正常时结果与对完整字幕调用 merge_segments 一致（停顿分段处可能略有差异）。
+    未定稿文本超过 LIVE_TAIL_MAX_CHARS（长时间没有标点）时强制定稿，保证每次 feed 的工作量有界
+    """
+
+    def __init__(
+        self,
+        soft_max: int = 200,
+        hard_max: int = 500,
+        pause_gap: float | None = PAUSE_GAP_SECONDS,
+    ):
+        self.soft_max = soft_max
+        self.hard_max = hard_max
+        self.pause_gap = pause_gap
+        self.paragraphs: list[dict] = []  # 所有已定稿的段落
+        self._tail: list[dict] = []       # 未定稿的原始 segment，第一个可能只剩后半段文本
+
+    def feed(self, segments: list[dict]) -> list[dict]:
+        """追加原始字幕，返回本次新定稿的段落"""
+        self._tail.extend(segments)
+        return self._commit(final=False)
+
+    def flush(self) -> list[dict]:
+        """字幕结束：剩余段落全部定稿并返回"""
+        return self._commit(final=True)
+
+    def _commit(self, final: bool) -> list[dict]:
+        merged = list(_iter_paragraphs(self._tail, self.soft_max, self.hard_max, self.pause_gap))
+        keep = 0 if final else LIVE_OPEN_PARAGRAPHS
+        tail_chars = sum(len(seg["text"].strip()) for seg in self._tail)
+        if keep and tail_chars > LIVE_TAIL_MAX_CHARS:
+            keep = 1 if len(merged) > 1 else 0
+
+        split = max(len(merged) - keep, 0)
+        if split == 0:
+            if final:
+                self._tail = []
+            return []
+        self._tail = self._remainder(merged[split][0]) if split < len(merged) else []
+        new_paragraphs = [para for _, para in merged[:split]]
+        self.paragraphs.extend(new_paragraphs)
+        return new_paragraphs
+
+    def _remainder(self, pos: int) -> list[dict]:
+        """拼接文本中 pos 之后的部分还原成 segment 列表（pos 落在 segment 中间时只保留后半段文本）"""
+        offset = 0
+        for idx, seg in enumerate(self._tail):
+            text = seg["text"].strip()
+            if not text:
+                continue
+            text_start = offset + 1 if offset else 0
+            text_end = text_start + len(text)
+            if pos < text_end:
+                cut = max(pos - text_start, 0)
+                head = {**seg, "text": text[cut:]} if cut else seg
+                return [head] + self._tail[idx + 1:]
+            offset = text_end
+        return []
+
+
+# --------------- 字幕缓存 ---------------
+
+def _segments_hash(segments: list[dict]) -> str:
+    raw = json.dumps(segments, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _fetch_cached(video_id: str, languages: list[str], refresh: bool = False) -> tuple[list[dict] | None, str]:
+    """
+    取原始字幕，返回 (segments, hash)
+
+    原始字幕的 hash 另存一个小条目（transcript_meta:），未过期时只读它，segments 返回 None，
+    合并缓存命中时就不用解压、解析整份原始字幕；refresh=True 跳过这一步。
+    过期则重新抓取，内容没变只刷新时间戳，变了才覆盖。
+    抓取失败（网络、限流）时有旧缓存就继续用旧的
+    """
+    langs = ",".join(languages)
+    module, meta_module = f"transcript:{langs}", f"transcript_meta:{langs}"
+    meta = get_cache_with_age(video_id, meta_module)
+    if not refresh and meta is not None and meta[1] < TRANSCRIPT_CACHE_TTL:
+        return None, meta[0]["hash"]
+
+    cached = get_cache(video_id, module)
+    try:
+        segments = fetch_transcript(video_id, languages)
+    except RuntimeError as e:
+        if cached is None:
+            raise
+        print(f"Transcript refresh failed for {video_id}, using cached copy: {str(e)[:100]}")
+        return cached["segments"], cached["hash"]
+
+    digest = _segments_hash(segments)
+    if cached is None or cached["hash"] != digest:
+        set_many(video_id, {module: {"hash": digest, "segments": segments}, meta_module: {"hash": digest}})
+    elif meta is None:
+        # 旧版本写入的缓存没有 meta 条目
+        set_cache(video_id, meta_module, {"hash": digest})
+    else:
+        touch_cache(video_id, meta_module)
+    return segments, digest
+
+
+def _cached_segments(video_id: str, languages: list[str], digest: str) -> tuple[list[dict], str]:
+    """_fetch_cached 只给了 hash 时读出原始字幕；已被淘汰或与 hash 不符时重新抓取"""
+    cached = get_cache(video_id, f"transcript:{','.join(languages)}")
+    if cached is not None and cached["hash"] == digest:
+        return cached["segments"], digest
+    return _fetch_cached(video_id, languages, refresh=True)
+
+
+def load_transcript(
+    video_id: str,
+    languages: list[str] = None,
+    soft_max: int = 200,
+    hard_max: int = 500,
+) -> list[dict]:
+    """
+    获取并合并字幕，原始字幕和合并结果都存入 video_cache，重复打开同一视频不再访问 YouTube
+
+    合并结果按 (语言, soft_max, hard_max, PAUSE_GAP_SECONDS, MERGE_VERSION) 缓存，并记录所依据的原始字幕 hash，
+    原始字幕变化后自动重新合并
+    """
+    return list(iter_transcript(video_id, languages, soft_max, hard_max))
+
+
+def iter_transcript(
+    video_id: str,
+    languages: list[str] = None,
+    soft_max: int = 200,
+    hard_max: int = 500,
+) -> Iterator[dict]:
+    """
+    load_transcript 的生成器版本：边合并边产出段落，全部产出后才写入合并缓存
+
+    抓取在第一次 next() 时发生，NoCaptionsError / RuntimeError 也从那里抛出
+    """
+    languages = languages or DEFAULT_LANGUAGES
+    segments, digest = _fetch_cached(video_id, languages)
+
+    module = (
+        f"transcript_merged:{','.join(languages)}:{soft_max}:{hard_max}"
+        f":{PAUSE_GAP_SECONDS:g}:v{MERGE_VERSION}"
+    )
+    cached = get_cache(video_id, module)
+    if cached is not None and cached.get("source_hash") == digest:
+        # 缓存对象在内存层共享，同样交出副本
+        for para in cached["segments"]:
+            yield dict(para)
+        return
+
+    if segments is None:
+        segments, digest = _cached_segments(video_id, languages, digest)
+    merged = []
+    for para in iter_merge_segments(segments, soft_max, hard_max):
+        merged.append(para)
+        # 交出副本：调用方会往段落里加 highlights，不能混进缓存
+        yield dict(para)
+    set_cache(video_id, module, {"source_hash": digest, "segments": merged})
 
 
 def transcript_to_text(segments: list[dict]) -> str:
@@ -1,37 +1,83 @@
 """
 词汇高亮服务 — 识别字幕中值得学习的短语
+
+词典快照可热更新：后台线程轮询词典目录，源 JSON 变化时编译新快照并整体替换。
+每个请求开始时取一次 current_dictionary()，整个请求都用这一份，
+替换发生时进行中的请求不受影响。
 """
 
-import re
-
-import json
-from pathlib import Path
-
-# 词典目录
-DICT_DIR = Path(__file__).parent.parent / "data" / "dictionaries"
-
-def load_dictionaries():
-    """加载所有 JSON 词典"""
-    phrases = []
-    
-    # 默认加载的基础词典
-    files = ["common_phrases.json", "workplace_slang.json"]
-    
-    for filename in files:
-        path = DICT_DIR / filename
-        if path.exists():
-            try:
-                data = json.loads(path.read_text(encoding="utf-8"))
-                phrases.extend(data)
-            except Exception as e:
-                print(f"Error loading dictionary {filename}: {e}")
-                
-    # 排序：长短语优先匹配 (Prevent "Time" masking "Time Off")
-    phrases.sort(key=lambda x: len(x["phrase"]), reverse=True)
-    return phrases
-
-# 初始化时加载（也可以做成缓存）
-BUSINESS_PHRASES = load_dictionaries()
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+from server.services.dictionary_index import DICT_DIR, DICT_FILES, DictionarySnapshot, load_snapshot
+from server.services.phrase_matcher import PhraseMatcher, fold_case
+
+# 词典目录轮询间隔（秒）
+DICT_RELOAD_INTERVAL = 2.0
+
+
+def build_matcher(phrases: list[dict]) -> PhraseMatcher:
+    return PhraseMatcher([fold_case(entry["phrase"]) for entry in phrases])
+
+
+# 初始化时 mmap 预编译的词典快照（源 JSON 变化时自动重建）
+_dictionary = load_snapshot()
+_watcher_lock = threading.Lock()
+_watcher: threading.Thread | None = None
+
+
+def current_dictionary() -> DictionarySnapshot:
+    """当前生效的词典快照"""
+    return _dictionary
+
+
+def reload_dictionary() -> bool:
+    """重新加载词典（必要时重建快照），版本变化则替换，返回是否替换"""
+    global _dictionary
+    snapshot = load_snapshot(strict=True)
+    if snapshot.version == _dictionary.version:
+        return False
+    old_version = _dictionary.version
+    _dictionary = snapshot
+    print(f"Dictionary reloaded: {old_version} → {snapshot.version} ({len(snapshot)} entries)")
+    return True
+
+
+def _source_signature() -> tuple:
+    signature = []
+    for filename in DICT_FILES:
+        try:
+            stat = (DICT_DIR / filename).stat()
+            signature.append((filename, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((filename, None, None))
+    return tuple(signature)
+
+
+def _watch_dictionaries():
+    signature = _source_signature()
+    while True:
+        time.sleep(DICT_RELOAD_INTERVAL)
+        current = _source_signature()
+        if current == signature:
+            continue
+        signature = current
+        try:
+            reload_dictionary()
+        except Exception as e:
+            # 词典写到一半或格式错误：保留旧快照，等下一次变化
+            print(f"Dictionary reload failed, keeping {_dictionary.version}: {e}")
+
+
+def start_dictionary_watcher():
+    """启动后台轮询线程（每个进程一个，重复调用无副作用）"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_dictionaries, name="dictionary-watcher", daemon=True)
+            _watcher.start()
 
 LEVEL_COLORS = {
     "A2": "green",
@@ -41,44 +87,86 @@ LEVEL_COLORS = {
 }
 
 
-def find_highlights(text: str, extra_phrases: list[dict] = None) -> list[dict]:
+def _resolve_overlaps(candidates: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
+    """
+    候选 (start, end, priority, idx) 中长匹配优先（"time off" 不会被 "time" 遮住），
+    等长时 priority 小的优先、同 priority 按词典顺序；被接受的区间互不重叠
+    """
+    candidates.sort(key=lambda c: (c[0] - c[1], c[2], c[3]))
+    starts: list[int] = []
+    ends: list[int] = []
+    accepted = []
+    for cand in candidates:
+        start, end = cand[0], cand[1]
+        pos = bisect_left(starts, start)
+        # 已接受的区间按 start 有序且互不重叠，只需检查左右邻居
+        if pos > 0 and ends[pos - 1] > start:
+            continue
+        if pos < len(starts) and starts[pos] < end:
+            continue
+        starts.insert(pos, start)
+        ends.insert(pos, end)
+        accepted.append(cand)
+    accepted.sort()
+    return accepted
+
+
+def find_highlights(
+    text: str,
+    extra_phrases: list[dict] = None,
+    dictionary: DictionarySnapshot | None = None,
+) -> list[dict]:
     """
     在文本中查找值得高亮的短语
 
+    extra_phrases: 额外词条，与词典短语等长冲突时优先
+    dictionary: 使用的词典快照，默认为当前快照
     返回: [{"phrase": "...", "start": 0, "end": 5, "translation": "...", "level": "B2", "color": "blue"}]
     """
-    phrases = BUSINESS_PHRASES.copy()
+    # 不能用 text.lower()：个别字符小写后变长，命中位置会和原文错位
+    text_lower = fold_case(text)
+    dictionary = dictionary or current_dictionary()
+    # (matcher, 按下标取词条的函数)
+    sources = [(dictionary.matcher, dictionary.entry)]
     if extra_phrases:
-        phrases = extra_phrases + phrases
+        sources.insert(0, (build_matcher(extra_phrases), extra_phrases.__getitem__))
+
+    candidates = []
+    for priority, (matcher, _) in enumerate(sources):
+        for start, end, idx in matcher.find_all(text_lower):
+            candidates.append((start, end, priority, idx))
 
     highlights = []
-    text_lower = text.lower()
-    used_ranges = set()
-
-    for entry in phrases:
-        pattern = r'\b' + re.escape(entry["phrase"].lower()) + r'\b'
-        for match in re.finditer(pattern, text_lower):
-            start, end = match.start(), match.end()
-            # 避免重叠
-            if any(start < ur_end and end > ur_start for ur_start, ur_end in used_ranges):
-                continue
-            used_ranges.add((start, end))
-            level = entry.get("level", "B2")
-            highlights.append({
-                "phrase": text[start:end],
-                "start": start,
-                "end": end,
-                "translation": entry.get("translation", ""),
-                "level": level,
-                "color": LEVEL_COLORS.get(level, "blue"),
-            })
-
-    highlights.sort(key=lambda x: x["start"])
+    for start, end, priority, idx in _resolve_overlaps(candidates):
+        entry = sources[priority][1](idx)
+        level = entry.get("level", "B2")
+        highlights.append({
+            "phrase": text[start:end],
+            "start": start,
+            "end": end,
+            "translation": entry.get("translation", ""),
+            "level": level,
+            "color": LEVEL_COLORS.get(level, "blue"),
+        })
     return highlights
 
 
-def highlight_segments(segments: list[dict], extra_phrases: list[dict] = None) -> list[dict]:
-    """为字幕段落添加高亮标注"""
+def highlight_segments(
+    segments: list[dict],
+    extra_phrases: list[dict] = None,
+    dictionary: DictionarySnapshot | None = None,
+) -> list[dict]:
+    """为字幕段落添加高亮标注（所有段落使用同一份词典快照）"""
+    return list(iter_highlight_segments(segments, extra_phrases, dictionary))
+
+
+def iter_highlight_segments(
+    segments: Iterable[dict],
+    extra_phrases: list[dict] = None,
+    dictionary: DictionarySnapshot | None = None,
+) -> Iterator[dict]:
+    """highlight_segments 的生成器版本，可直接接在 iter_merge_segments 后面逐段处理"""
+    dictionary = dictionary or current_dictionary()
     for segment in segments:
-        segment["highlights"] = find_highlights(segment["text"], extra_phrases)
-    return segments
+        segment["highlights"] = find_highlights(segment["text"], extra_phrases, dictionary)
+        yield segment
@@ -7,7 +7,7 @@ import AnalysisPanel from "./components/AnalysisPanel";
 import DeckPanel from "./components/DeckPanel";
 import TabBar from "./components/TabBar";
 import UrlInput from "./components/UrlInput";
-import { fetchTranscript, startAnalysis, generateToc, generateContextNotes, startHighlightsStream, saveToDeck } from "@/lib/api";
+import { streamTranscript, startAnalysis, generateToc, generateContextNotes, startHighlightsStream, saveToDeck } from "@/lib/api";
 import type { TranscriptSegment, Chapter, ContextNote, Highlight } from "@/lib/types";
 
 function extractVideoId(url: string): string {
@@ -77,8 +77,8 @@ export default function Home() {
       // Load video
       setVideoId(vid);
 
-      // Fetch transcript
-      const data = await fetchTranscript(url);
+      // Fetch transcript — 段落流式到达时先渲染，全部到达后再启动 AI 任务
+      const data = await streamTranscript(url, (partial) => setSegments(partial));
       setSegments(data.segments);
 
       // Helper: start highlights streaming (called after ToC completes)
@@ -91,6 +91,31 @@ export default function Home() {
         let totalChunks = chaptersData?.length || 0;
         let completedChunks = 0;
 
+        // 合并高亮到 segments，跳过与已有高亮重叠的（单条推送和 chunk_result 会重复）
+        const mergeHighlights = (chunkHighlights: Record<string, Highlight[]>) => {
+          setSegments((prev) => {
+            const updated = [...prev];
+            for (const [segIdxStr, aiHighlights] of Object.entries(chunkHighlights)) {
+              const idx = Number(segIdxStr);
+              if (idx < 0 || idx >= updated.length || !aiHighlights.length) continue;
+              const seg = updated[idx];
+              const existing = seg.highlights || [];
+              const existingRanges = existing.map((h) => [h.start, h.end] as [number, number]);
+              const newHighlights = [...existing];
+              for (const ah of aiHighlights) {
+                const overlaps = existingRanges.some(([s, e]) => ah.start < e && ah.end > s);
+                if (!overlaps) {
+                  newHighlights.push(ah);
+                  existingRanges.push([ah.start, ah.end]);
+                }
+              }
+              newHighlights.sort((a, b) => a.start - b.start);
+              updated[idx] = { ...seg, highlights: newHighlights };
+            }
+            return updated;
+          });
+        };
+
         startHighlightsStream(
           data.segments,
           vid,
@@ -106,27 +131,7 @@ export default function Home() {
                   : `${completedChunks}/${totalChunks} chunks done`
               );
             }
-            setSegments((prev) => {
-              const updated = [...prev];
-              for (const [segIdxStr, aiHighlights] of Object.entries(chunkHighlights)) {
-                const idx = Number(segIdxStr);
-                if (idx < 0 || idx >= updated.length || !aiHighlights.length) continue;
-                const seg = updated[idx];
-                const existing = seg.highlights || [];
-                const existingRanges = existing.map((h) => [h.start, h.end] as [number, number]);
-                const newHighlights = [...existing];
-                for (const ah of aiHighlights) {
-                  const overlaps = existingRanges.some(([s, e]) => ah.start < e && ah.end > s);
-                  if (!overlaps) {
-                    newHighlights.push(ah);
-                    existingRanges.push([ah.start, ah.end]);
-                  }
-                }
-                newHighlights.sort((a, b) => a.start - b.start);
-                updated[idx] = { ...seg, highlights: newHighlights };
-              }
-              return updated;
-            });
+            mergeHighlights(chunkHighlights);
           },
           // onProgress
           (info) => {
@@ -152,6 +157,8 @@ export default function Home() {
             setIsGeneratingHighlights(false);
             setHighlightsProgress("");
           },
+          // onHighlight — 生成中逐条显示
+          (highlights) => mergeHighlights(highlights),
         );
       };
 
@@ -194,12 +201,21 @@ export default function Home() {
         .map((s: TranscriptSegment) => s.text)
         .join(" ");
 
+      // delta 事件逐段拼接；model 变化说明后端 fallback 到了下一个模型，丢弃之前的增量
+      const streamingModel: Record<string, string> = {};
+
       startAnalysis(
         transcriptText,
         persona,
         (event, eventData) => {
           if (event === "progress") {
             setAnalysisProgress(eventData);
+          } else if (event === "delta") {
+            const parsed = JSON.parse(eventData);
+            const setter = parsed.step === "layer0" ? setLayer0 : setBreakdown;
+            const reset = streamingModel[parsed.step] !== parsed.model;
+            streamingModel[parsed.step] = parsed.model;
+            setter((prev) => (reset ? "" : prev) + parsed.text);
           } else if (event === "layer0") {
             const parsed = JSON.parse(eventData);
             setLayer0(parsed.content);
@@ -11,6 +11,69 @@ export async function fetchTranscript(url: string) {
   return res.json();
 }
 
+// 流式获取字幕：段落合并、高亮好一批就回调一次（传入目前为止的全部段落），
+// 全部到达后 resolve，返回值与 fetchTranscript 相同
+export async function streamTranscript(
+  url: string,
+  onSegments: (segments: TranscriptSegment[]) => void
+): Promise<TranscriptResponse> {
+  const res = await fetch(
+    `${API_BASE}/api/transcript/stream?url=${encodeURIComponent(url)}`
+  );
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({ detail: res.statusText }));
+    throw new Error(err.detail || "Failed to fetch transcript");
+  }
+  const reader = res.body?.getReader();
+  if (!reader) throw new Error("No response body");
+
+  const result: TranscriptResponse = { video_id: "", segments: [], total_segments: 0 };
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let eventName = "";
+  let finished = false;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop() || "";
+
+    const before = result.segments.length;
+    for (const line of lines) {
+      if (line.startsWith("event:")) {
+        eventName = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        const data = line.slice(5).trim();
+        if (!eventName || !data) continue;
+        const parsed = JSON.parse(data);
+        if (eventName === "meta") {
+          result.video_id = parsed.video_id;
+          result.dictionary_version = parsed.dictionary_version;
+        } else if (eventName === "segment") {
+          result.segments.push(parsed);
+        } else if (eventName === "done") {
+          result.total_segments = parsed.total_segments;
+          finished = true;
+        }
+        eventName = "";
+      }
+    }
+    if (result.segments.length > before) {
+      onSegments([...result.segments]);
+    }
+  }
+  // 连接中断或服务端中途出错时流会直接结束，没有 done —— 不能当作完整的字幕返回
+  if (!finished) {
+    throw new Error(
+      `Transcript stream ended early (${result.segments.length} segments received)`
+    );
+  }
+  return result;
+}
+
 export async function fetchPersonas() {
   const res = await fetch(`${API_BASE}/api/personas`);
   if (!res.ok) throw new Error("Failed to fetch personas");
@@ -133,7 +196,7 @@ export async function generateContextNotes(
 
 // --------------- Streaming Highlights ---------------
 
-import type { Chapter, Highlight } from "./types";
+import type { Chapter, Highlight, TranscriptResponse, TranscriptSegment } from "./types";
 
 export function startHighlightsStream(
   segments: { text: string; start: number; duration: number }[],
@@ -142,7 +205,9 @@ export function startHighlightsStream(
   onChunkResult: (highlights: Record<string, Highlight[]>, count: number, chapterTitle?: string) => void,
   onProgress: (info: { cached_chunks?: number; remaining_chunks?: number; total_chunks?: number; chapter_title?: string }) => void,
   onDone: (info: { total: number; failed_chunks: string[]; cached: boolean }) => void,
-  onError: (error: string) => void
+  onError: (error: string) => void,
+  // 单条高亮（chunk 生成过程中逐条推送，chunk_result 到达时会再包含一次）
+  onHighlight?: (highlights: Record<string, Highlight[]>, chapterTitle?: string) => void
 ) {
   const controller = new AbortController();
 
@@ -187,6 +252,9 @@ export function startHighlightsStream(
               if (eventName === "chunk_result") {
                 const parsed = JSON.parse(data);
                 onChunkResult(parsed.highlights, parsed.count ?? parsed.total ?? 0, parsed.chapter_title);
+              } else if (eventName === "highlight") {
+                const parsed = JSON.parse(data);
+                onHighlight?.(parsed.highlights, parsed.chapter_title);
               } else if (eventName === "progress") {
                 onProgress(JSON.parse(data));
               } else if (eventName === "done") {
@@ -28,6 +28,7 @@ export interface TranscriptResponse {
   video_id: string;
   segments: TranscriptSegment[];
   total_segments: number;
+  dictionary_version?: string;
 }
 
 export interface PersonasResponse {